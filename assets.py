@@ -1,5 +1,7 @@
 from config import LauncherConfig, DEFAULT_CONFIG
-from util import download_file, download_files
+from util import DownloadBatch, download_file
+from tqdm import tqdm
+import store
 import json
 import os
 
@@ -10,32 +12,139 @@ def _download_asset_manifest(
     asset_index: str, url: str, config: LauncherConfig = DEFAULT_CONFIG
 ):
     download_file(
-        url, os.path.join(config.assets_dir, "indexes", f"{asset_index}.json")
+        url,
+        os.path.join(config.assets_dir, "indexes", f"{asset_index}.json"),
+        config=config,
     )
 
 
+def _scan_objects(objects_dir: str) -> dict[str, int]:
+    """Map every object in the store to its size.
+
+    The store is listed with one scandir per hash-prefix directory instead of
+    a stat per object of the index.
+    """
+    present = {}
+    for prefix in range(256):
+        try:
+            with os.scandir(os.path.join(objects_dir, f"{prefix:02x}")) as it:
+                for entry in it:
+                    if entry.is_file():
+                        present[entry.name] = entry.stat().st_size
+        except FileNotFoundError:
+            continue
+
+    return present
+
+
 def download_assets(
-    asset_index: str, url: str, config: LauncherConfig = DEFAULT_CONFIG
+    asset_index: str,
+    url: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    batch: DownloadBatch | None = None,
 ):
+    """Sync the object store with an asset index.
+
+    Only objects that are missing or have the wrong size are downloaded, so
+    an index that shares objects with an installed one only costs its delta.
+    With a batch, the objects are only queued.
+    """
     indexes_dir = os.path.join(config.assets_dir, "indexes")
     objects_dir = os.path.join(config.assets_dir, "objects")
-    if not os.path.exists(os.path.join(indexes_dir, f"{asset_index}.json")):
-        _download_asset_manifest(asset_index, url, config)
 
-    else:
-        print(f"Assets {asset_index} are already installed!")
-        return 0
+    index_path = os.path.join(indexes_dir, f"{asset_index}.json")
+    if not os.path.exists(index_path):
+        shared_index = config.shared_path(index_path)
+        if shared_index is not None:
+            store.link_file(shared_index, index_path, symlink=True)
+        else:
+            _download_asset_manifest(asset_index, url, config)
 
     raw_assets = None
     with open(os.path.join(indexes_dir, f"{asset_index}.json"), "r") as ai:
         raw_assets = json.loads(ai.read())
 
+    present = _scan_objects(objects_dir)
+    # Objects of the shared roots are linked instead of downloaded
+    shared = []
+    for root in config.shared_roots:
+        shared_dir = os.path.join(
+            root, os.path.relpath(objects_dir, config.minecraft_dir)
+        )
+        shared.append((shared_dir, _scan_objects(shared_dir)))
+
     urls = []
     paths = []
+    hashes = []
+    sizes = []
+
+    queued = set()
+    reused = 0
+    reused_bytes = 0
+    linked = 0
+    missing_bytes = 0
 
     for ra in raw_assets["objects"]:
         asset_hash = raw_assets["objects"][ra]["hash"]
+        asset_size = raw_assets["objects"][ra].get("size")
+
+        # Several names can point to the same object
+        if asset_hash in queued:
+            continue
+        queued.add(asset_hash)
+
+        if asset_hash in present and (
+            asset_size is None or present[asset_hash] == asset_size
+        ):
+            reused += 1
+            reused_bytes += present[asset_hash]
+            continue
+
+        if asset_hash in present:
+            # Corrupt or truncated, fetch it again
+            os.remove(os.path.join(objects_dir, asset_hash[:2], asset_hash))
+
+        shared_dir = next(
+            (
+                d
+                for d, objects in shared
+                if asset_hash in objects
+                and (asset_size is None or objects[asset_hash] == asset_size)
+            ),
+            None,
+        )
+        if shared_dir is not None:
+            store.link_file(
+                os.path.join(shared_dir, asset_hash[:2], asset_hash),
+                os.path.join(objects_dir, asset_hash[:2], asset_hash),
+                symlink=True,
+            )
+            linked += 1
+            continue
+
         urls.append(f"{ASSETS_URL}/{asset_hash[:2]}/{asset_hash}")
         paths.append(os.path.join(objects_dir, asset_hash[:2], asset_hash))
+        hashes.append(asset_hash)
+        sizes.append(asset_size)
+        missing_bytes += asset_size or 0
+
+    print(
+        f"Assets {asset_index}: {len(urls)} objects to download "
+        f"({tqdm.format_sizeof(missing_bytes, 'B', 1024)}), {reused} already present "
+        f"({tqdm.format_sizeof(reused_bytes, 'B', 1024)} saved)"
+        + (f", {linked} linked from the shared roots" if linked else "")
+    )
+
+    if not urls:
+        return 0
+
+    own_batch = batch is None
+    if own_batch:
+        batch = DownloadBatch(config)
+
+    batch.add(urls, paths, hashes=hashes, sizes=sizes, phase="assets")
+
+    if own_batch:
+        batch.run("Downloading objects")
 
-    download_files(urls, paths, desc="Downloading objects")
+    return 0
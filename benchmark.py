@@ -0,0 +1,586 @@
+"""Offline install benchmark.
+
+Serves synthetic Mojang, Fabric, Forge and Modrinth fixtures from a local
+HTTP server, which every download origin is mirrored to, and times
+`launcher.install_version`, `fabric.install`, `forge.install` and
+`mrpack.install` against it (eg. `python benchmark.py --latency 0.02`).
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import LauncherConfig, GameConfig
+import multiprocessing
+import threading
+import argparse
+import tempfile
+import zipfile
+import hashlib
+import random
+import shutil
+import json
+import lzma
+import time
+import os
+
+import fabric
+import forge
+import java
+import launcher
+import mrpack
+import tracing
+
+MINECRAFT_VERSION = "1.99"
+FABRIC_LOADER = "0.99.0"
+FORGE_VERSION = "99.0.0"
+RUNTIME = "java-runtime-bench"
+ASSET_INDEX = "bench"
+
+# Every origin the launcher downloads from
+HOSTS = (
+    "launchermeta.mojang.com",
+    "piston-meta.mojang.com",
+    "piston-data.mojang.com",
+    "resources.download.minecraft.net",
+    "libraries.minecraft.net",
+    "meta.fabricmc.net",
+    "maven.fabricmc.net",
+    "maven.minecraftforge.net",
+    "cdn.modrinth.com",
+)
+
+SCENARIOS = ("vanilla", "fabric", "forge", "mrpack")
+
+# Spans reported as the phases of an install, they can overlap
+PHASES = (
+    "catalog",
+    "plan",
+    "client",
+    "java",
+    "assets",
+    "libraries",
+    "natives",
+    "files",
+    "processors",
+    "verify",
+    "overrides",
+)
+
+
+class Fixtures:
+    """Synthetic files laid out as `<root>/<host>/<path>/_`.
+
+    Every URL gets its own directory, since a URL can also be the prefix of
+    another one (Fabric meta).
+    """
+
+    def __init__(self, root: str, args):
+        self.root = root
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+    def _blob(self, size: int) -> bytes:
+        return self.rng.randbytes(size)
+
+    def _write(self, url: str, data: bytes) -> dict:
+        path = os.path.join(self.root, url.removeprefix("https://"), "_")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        return {"url": url, "sha1": hashlib.sha1(data).hexdigest(), "size": len(data)}
+
+    def _write_json(self, url: str, value) -> dict:
+        return self._write(url, json.dumps(value).encode())
+
+    def _jar(self, files: dict[str, bytes]) -> bytes:
+        path = os.path.join(self.root, "tmp.jar")
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, data in files.items():
+                zf.writestr(name, data)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+
+        return data
+
+    def _library(self, group: str, name: str, version: str, host: str, size: int):
+        path = f"{group.replace('.', '/')}/{name}/{version}/{name}-{version}.jar"
+        artifact = self._write(f"https://{host}/{path}", self._blob(size))
+
+        return {
+            "name": f"{group}:{name}:{version}",
+            "downloads": {"artifact": {"path": path, **artifact}},
+        }
+
+    def build(self, platform: str):
+        args = self.args
+
+        # Assets, many small objects
+        objects = {}
+        for i in range(args.objects):
+            data = self._blob(self.rng.randint(1, 2 * args.object_size))
+            h = hashlib.sha1(data).hexdigest()
+            self._write(f"https://resources.download.minecraft.net/{h[:2]}/{h}", data)
+            objects[f"minecraft/bench/{i}"] = {"hash": h, "size": len(data)}
+        asset_index = self._write_json(
+            f"https://piston-meta.mojang.com/v1/packages/{ASSET_INDEX}.json",
+            {"objects": objects},
+        )
+
+        # Java runtime, some files only come lzma compressed
+        files = {"bin": {"type": "directory"}}
+        for i in range(args.runtime_files):
+            data = self._blob(self.rng.randint(1, 2 * args.runtime_file_size))
+            raw = self._write(f"https://piston-data.mojang.com/runtime/{i}", data)
+            downloads = {"raw": raw}
+            if i % 2:
+                downloads["lzma"] = self._write(
+                    f"https://piston-data.mojang.com/runtime/{i}.lzma",
+                    lzma.compress(data),
+                )
+            files[f"lib/file{i}"] = {
+                "type": "file",
+                "executable": False,
+                "downloads": downloads,
+            }
+        files["bin/java"] = {
+            "type": "file",
+            "executable": True,
+            "downloads": {
+                "raw": self._write(
+                    "https://piston-data.mojang.com/runtime/java", b"#!/bin/sh\n"
+                )
+            },
+        }
+        files["bin/javaw"] = {"type": "link", "target": "java"}
+        runtime_manifest = self._write_json(
+            f"https://piston-meta.mojang.com/v1/packages/{RUNTIME}.json",
+            {"files": files},
+        )
+        self._write_json(
+            java.JAVA_MANIFEST,
+            {
+                "gamecore": {RUNTIME: []},
+                platform: {RUNTIME: [{"manifest": runtime_manifest}]},
+            },
+        )
+
+        # Vanilla version
+        version_libraries = [
+            self._library(
+                "com.bench",
+                f"lib{i}",
+                "1.0",
+                "libraries.minecraft.net",
+                self.rng.randint(1, 2 * args.library_size),
+            )
+            for i in range(args.libraries)
+        ]
+        native = self._library(
+            "org.bench", "natives", "1.0", "libraries.minecraft.net", 1
+        )
+        native_jar = self._jar(
+            {"META-INF/MANIFEST.MF": b"", "libbench.so": self._blob(64 * 1024)}
+        )
+        native["name"] += f":natives-{platform.split('-')[0]}"
+        native["downloads"]["artifact"].update(
+            self._write(native["downloads"]["artifact"]["url"], native_jar)
+        )
+        version_libraries.append(native)
+
+        client = self._write(
+            "https://piston-data.mojang.com/v1/objects/client.jar",
+            self._jar({"net/minecraft/client/main/Main.class": self._blob(1 << 20)}),
+        )
+        version = self._write_json(
+            f"https://piston-meta.mojang.com/v1/packages/{MINECRAFT_VERSION}.json",
+            {
+                "id": MINECRAFT_VERSION,
+                "type": "release",
+                "assetIndex": {"id": ASSET_INDEX, **asset_index},
+                "downloads": {"client": client},
+                "javaVersion": {"component": RUNTIME},
+                "mainClass": "net.minecraft.client.main.Main",
+                "arguments": {
+                    "game": ["--username", "${auth_player_name}"],
+                    "jvm": ["-cp", "${classpath}"],
+                },
+                "libraries": version_libraries,
+            },
+        )
+        self._write_json(
+            "https://launchermeta.mojang.com/mc/game/version_manifest.json",
+            {
+                "latest": {"release": MINECRAFT_VERSION},
+                "versions": [
+                    {
+                        "id": MINECRAFT_VERSION,
+                        "type": "release",
+                        "url": version["url"],
+                        "time": "2099-01-01T00:00:00+00:00",
+                        "releaseTime": "2099-01-01T00:00:00+00:00",
+                    }
+                ],
+            },
+        )
+
+        # Fabric
+        self._write_json(
+            fabric.FABRIC_MINECRAFT_MANIFEST,
+            [{"version": MINECRAFT_VERSION, "stable": True}],
+        )
+        self._write_json(
+            fabric.FABRIC_LOADERS_MANIFEST, [{"version": FABRIC_LOADER, "stable": True}]
+        )
+        fabric_id = f"fabric-loader-{FABRIC_LOADER}-{MINECRAFT_VERSION}"
+        self._write_json(
+            f"{fabric.FABRIC_LOADERS_MANIFEST}/{MINECRAFT_VERSION}/{FABRIC_LOADER}/profile/json",
+            {
+                "id": fabric_id,
+                "inheritsFrom": MINECRAFT_VERSION,
+                "mainClass": "net.fabricmc.loader.impl.launch.knot.KnotClient",
+                "arguments": {"game": [], "jvm": []},
+                "libraries": [
+                    self._library(
+                        "net.fabricmc",
+                        "fabric-loader",
+                        FABRIC_LOADER,
+                        "maven.fabricmc.net",
+                        args.library_size,
+                    )
+                ],
+            },
+        )
+
+        # Forge, an installer without processors
+        forge_id = f"{MINECRAFT_VERSION}-{FORGE_VERSION}"
+        self._write(
+            forge.FORGE_VERSION_MANIFEST_URL,
+            (
+                "<metadata><versioning><versions>"
+                f"<version>{forge_id}</version>"
+                "</versions></versioning></metadata>"
+            ).encode(),
+        )
+        forge_libraries = [
+            self._library(
+                "net.minecraftforge",
+                f"forgelib{i}",
+                "1.0",
+                "maven.minecraftforge.net",
+                args.library_size,
+            )
+            for i in range(args.libraries // 4)
+        ]
+        installer = self._jar(
+            {
+                "install_profile.json": json.dumps(
+                    {
+                        "json": "/version.json",
+                        "libraries": forge_libraries,
+                        "processors": [],
+                        "data": {},
+                    }
+                ).encode(),
+                "version.json": json.dumps(
+                    {
+                        "id": f"forge-{forge_id}",
+                        "inheritsFrom": MINECRAFT_VERSION,
+                        "mainClass": "cpw.mods.bootstraplauncher.BootstrapLauncher",
+                        "arguments": {"game": [], "jvm": []},
+                        "libraries": forge_libraries,
+                    }
+                ).encode(),
+                f"maven/net/minecraftforge/forge/{forge_id}/forge-{forge_id}.jar": self._blob(
+                    args.library_size
+                ),
+            }
+        )
+        self._write(
+            f"https://maven.minecraftforge.net/net/minecraftforge/forge/{forge_id}/forge-{forge_id}-installer.jar",
+            installer,
+        )
+
+        # Modrinth pack
+        pack_files = []
+        for i in range(args.mods):
+            data = self._blob(self.rng.randint(1, 2 * args.mod_size))
+            mod = self._write(f"https://cdn.modrinth.com/data/bench/mod{i}.jar", data)
+            pack_files.append(
+                {
+                    "path": f"mods/mod{i}.jar",
+                    "hashes": {
+                        "sha1": mod["sha1"],
+                        "sha512": hashlib.sha512(data).hexdigest(),
+                    },
+                    "downloads": [mod["url"]],
+                    "fileSize": mod["size"],
+                }
+            )
+        self.mrpack = os.path.join(self.root, "bench.mrpack")
+        with zipfile.ZipFile(self.mrpack, "w") as zf:
+            zf.writestr(
+                "modrinth.index.json",
+                json.dumps(
+                    {
+                        "name": "bench",
+                        "versionId": "1.0",
+                        "dependencies": {
+                            "minecraft": MINECRAFT_VERSION,
+                            "fabric-loader": FABRIC_LOADER,
+                        },
+                        "files": pack_files,
+                    }
+                ),
+            )
+            for i in range(args.overrides):
+                folder = "config" if i % 2 else "resourcepacks"
+                zf.writestr(
+                    f"overrides/{folder}/file{i}",
+                    self._blob(self.rng.randint(1, 2 * args.override_size)),
+                )
+            zf.writestr("client-overrides/options.txt", b"renderDistance:8\n")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def snapshot(self) -> tuple[int, int, int]:
+        with self.lock:
+            return (self.requests, self.bytes, self.errors)
+
+
+def _handler(root: str, args, stats: Stats):
+    rng = random.Random(args.seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *log_args):
+            pass
+
+        def do_GET(self):
+            # Mirrored as /<host>/<path>
+            path = os.path.normpath(os.path.join(root, self.path.lstrip("/"), "_"))
+            if not path.startswith(root) or not os.path.isfile(path):
+                self.send_error(404)
+                return
+
+            if args.latency:
+                time.sleep(args.latency)
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+            start = 0
+            status = 200
+            range_header = self.headers.get("Range")
+            if range_header and range_header.startswith("bytes="):
+                start = int(range_header[6:].split("-")[0])
+                if start >= len(data):
+                    self.send_error(416)
+                    return
+                status = 206
+
+            body = data[start:]
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 206:
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+                )
+            self.end_headers()
+
+            with stats.lock:
+                stats.requests += 1
+                fail = rng.random() < args.error_rate
+                if fail:
+                    stats.errors += 1
+
+            # A failing response is cut off halfway
+            if fail:
+                body = body[: len(body) // 2]
+
+            chunk = 64 * 1024
+            for i in range(0, len(body), chunk):
+                self.wfile.write(body[i : i + chunk])
+                with stats.lock:
+                    stats.bytes += len(body[i : i + chunk])
+                if args.bandwidth:
+                    time.sleep(chunk / args.bandwidth)
+
+            if fail:
+                self.close_connection = True
+
+    return Handler
+
+
+def _run_scenario(
+    scenario: str, minecraft_dir: str, port: int, mrpack_path, backend: str, queue
+):
+    """Run one install in a child process, so its peak RSS is its own."""
+    import resource
+
+    base = f"http://127.0.0.1:{port}"
+    config = LauncherConfig(
+        minecraft_dir,
+        GameConfig(),
+        mirrors={f"https://{host}/": [f"{base}/{host}/"] for host in HOSTS},
+        metadata_ttl=0,
+        download_backend=backend,
+    )
+
+    phases = {}
+
+    def sink(record: dict):
+        if record["name"] in PHASES:
+            name = record["name"]
+            phases[name] = phases.get(name, 0.0) + record["duration"]
+
+    tracing.add_sink(sink)
+
+    start = time.perf_counter()
+    match scenario:
+        case "vanilla":
+            launcher.install_version(MINECRAFT_VERSION, config)
+        case "fabric":
+            fabric.install(MINECRAFT_VERSION, FABRIC_LOADER, config)
+        case "forge":
+            forge.install(MINECRAFT_VERSION, FORGE_VERSION, config)
+        case "mrpack":
+            mrpack.install(mrpack_path, config)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux
+    queue.put(
+        {
+            "seconds": seconds,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "phases": phases,
+        }
+    )
+
+
+def run(args) -> list[dict]:
+    workdir = tempfile.mkdtemp(prefix="clmc-bench-")
+    serve_root = os.path.join(workdir, "serve")
+
+    platform = LauncherConfig(workdir).platform
+    fixtures = Fixtures(serve_root, args)
+    fixtures.build(platform)
+
+    stats = Stats()
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), _handler(os.path.abspath(serve_root), args, stats)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    context = multiprocessing.get_context("fork" if os.name == "posix" else "spawn")
+    results = []
+    try:
+        for scenario in args.scenarios:
+            minecraft_dir = os.path.join(workdir, scenario)
+            for run_name in ("cold", "warm")[: 2 if args.warm else 1]:
+                before = stats.snapshot()
+
+                queue = context.Queue()
+                process = context.Process(
+                    target=_run_scenario,
+                    args=(
+                        scenario,
+                        minecraft_dir,
+                        port,
+                        fixtures.mrpack,
+                        args.backend,
+                        queue,
+                    ),
+                )
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    raise Exception(f"Benchmark {scenario} ({run_name}) failed")
+                result = queue.get()
+
+                after = stats.snapshot()
+                requests, nbytes, errors = (a - b for a, b in zip(after, before))
+                result.update(
+                    scenario=scenario,
+                    run=run_name,
+                    requests=requests,
+                    bytes=nbytes,
+                    injected_errors=errors,
+                    files_per_second=requests / result["seconds"],
+                    mb_per_second=nbytes / result["seconds"] / (1 << 20),
+                )
+                results.append(result)
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)}, all by default"
+    )
+    parser.add_argument("--objects", type=int, default=3000)
+    parser.add_argument("--object-size", type=int, default=8 * 1024)
+    parser.add_argument("--libraries", type=int, default=60)
+    parser.add_argument("--library-size", type=int, default=256 * 1024)
+    parser.add_argument("--runtime-files", type=int, default=200)
+    parser.add_argument("--runtime-file-size", type=int, default=128 * 1024)
+    parser.add_argument("--mods", type=int, default=100)
+    parser.add_argument("--mod-size", type=int, default=512 * 1024)
+    parser.add_argument("--overrides", type=int, default=200)
+    parser.add_argument("--override-size", type=int, default=64 * 1024)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds before each response"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=0.0, help="bytes/s per connection"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of cut off responses"
+    )
+    parser.add_argument("--backend", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm", action="store_true", help="also time a reinstall")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    results = run(args)
+
+    print()
+    print(
+        f"{'scenario':<10}{'run':<6}{'seconds':>9}{'files/s':>10}"
+        f"{'MB/s':>9}{'peak MB':>9}{'errors':>8}"
+    )
+    for r in results:
+        print(
+            f"{r['scenario']:<10}{r['run']:<6}{r['seconds']:>9.2f}"
+            f"{r['files_per_second']:>10.1f}{r['mb_per_second']:>9.1f}"
+            f"{r['peak_rss_mb']:>9.1f}{r['injected_errors']:>8}"
+        )
+        phases = ", ".join(f"{k} {v:.2f}s" for k, v in r["phases"].items())
+        print(f"{'':<16}{phases}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
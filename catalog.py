@@ -0,0 +1,251 @@
+from config import LauncherConfig, DEFAULT_CONFIG
+from manifest import VERSION_MANIFEST, ManifestVersion
+from util import download_metadata, version_key
+import xml.etree.ElementTree as ET
+import sqlite3
+import tracing
+import json
+import os
+
+# fabric and forge import the catalog, only use them at call time
+import fabric
+import forge
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    url TEXT NOT NULL,
+    time TEXT NOT NULL,
+    release_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS versions_type ON versions (type, release_time);
+CREATE INDEX IF NOT EXISTS versions_release_time ON versions (release_time);
+CREATE TABLE IF NOT EXISTS fabric_game (
+    version TEXT PRIMARY KEY,
+    stable INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fabric_loader (
+    version TEXT PRIMARY KEY,
+    stable INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fabric_loader_position ON fabric_loader (stable, position);
+CREATE TABLE IF NOT EXISTS forge (
+    minecraft_version TEXT NOT NULL,
+    forge_version TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (minecraft_version, forge_version)
+);
+CREATE INDEX IF NOT EXISTS forge_position ON forge (minecraft_version, position);
+"""
+
+
+class Catalog:
+    """Local SQLite index of the vanilla, Fabric and Forge versions.
+
+    Each source is refreshed through the metadata cache and only parsed
+    again when its file changed.
+    """
+
+    def __init__(
+        self,
+        config: LauncherConfig = DEFAULT_CONFIG,
+        sources=("mojang", "fabric", "forge"),
+    ):
+        self.config = config
+        os.makedirs(os.path.dirname(config.catalog), exist_ok=True)
+        self.db = sqlite3.connect(config.catalog)
+        self.db.executescript(SCHEMA)
+
+        self.refresh(sources)
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, sources=("mojang", "fabric", "forge")):
+        with tracing.span("catalog", sources=",".join(sources)):
+            self._refresh(sources)
+
+    def _refresh(self, sources):
+        if "mojang" in sources:
+            download_metadata(
+                VERSION_MANIFEST, self.config.version_manifest, self.config
+            )
+            self._update("mojang", self.config.version_manifest, self._load_mojang)
+
+        if "fabric" in sources:
+            fabric._download_minecraft_versions(self.config)
+            fabric._download_loader_versions(self.config)
+            self._update(
+                "fabric_game",
+                self.config.fabric_minecraft_versions,
+                self._load_fabric_game,
+            )
+            self._update(
+                "fabric_loader", self.config.fabric_loaders, self._load_fabric_loader
+            )
+
+        if "forge" in sources:
+            forge._download_version_manifest(self.config)
+            self._update("forge", self.config.forge_manifest, self._load_forge)
+
+    def _update(self, name: str, path: str, load):
+        st = os.stat(path)
+        row = self.db.execute(
+            "SELECT mtime_ns, size FROM sources WHERE name = ?", (name,)
+        ).fetchone()
+        if row == (st.st_mtime_ns, st.st_size):
+            return
+
+        with self.db:
+            load(path)
+            self.db.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                (name, st.st_mtime_ns, st.st_size),
+            )
+
+    def _load_mojang(self, path: str):
+        with open(path, "r") as f:
+            raw_manifest = json.load(f)
+
+        self.db.execute("DELETE FROM versions")
+        self.db.executemany(
+            "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)",
+            [
+                (v["id"], v["type"], v["url"], v["time"], v["releaseTime"])
+                for v in raw_manifest["versions"]
+            ],
+        )
+
+    def _load_fabric_game(self, path: str):
+        with open(path, "r") as f:
+            raw_versions = json.load(f)
+
+        self.db.execute("DELETE FROM fabric_game")
+        self.db.executemany(
+            "INSERT OR REPLACE INTO fabric_game VALUES (?, ?)",
+            [(v["version"], v.get("stable", False)) for v in raw_versions],
+        )
+
+    def _load_fabric_loader(self, path: str):
+        with open(path, "r") as f:
+            raw_loaders = json.load(f)
+
+        # Fabric meta lists the newest loader first
+        self.db.execute("DELETE FROM fabric_loader")
+        self.db.executemany(
+            "INSERT OR REPLACE INTO fabric_loader VALUES (?, ?, ?)",
+            [
+                (v["version"], v.get("stable", False), i)
+                for i, v in enumerate(raw_loaders)
+            ],
+        )
+
+    def _load_forge(self, path: str):
+        root = ET.parse(path).getroot()
+
+        builds = []
+        for v in root.iterfind("versioning/versions/version"):
+            if not v.text or "-" not in v.text:
+                continue
+            minecraft_version, forge_version = v.text.split("-", 1)
+            builds.append((minecraft_version, forge_version))
+
+        builds.sort(key=lambda b: version_key(b[1]), reverse=True)
+
+        self.db.execute("DELETE FROM forge")
+        self.db.executemany(
+            "INSERT OR REPLACE INTO forge VALUES (?, ?, ?)",
+            [(mc, forge, i) for i, (mc, forge) in enumerate(builds)],
+        )
+
+    # Vanilla
+    def version(self, version_id: str) -> ManifestVersion | None:
+        row = self.db.execute(
+            "SELECT id, type, url, time, release_time FROM versions WHERE id = ?",
+            (version_id,),
+        ).fetchone()
+        return ManifestVersion(*row) if row else None
+
+    def has_version(self, version_id: str) -> bool:
+        return self.version(version_id) is not None
+
+    def versions(
+        self,
+        type: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> list[ManifestVersion]:
+        """Versions by type and release date (ISO 8601), newest first."""
+        query = "SELECT id, type, url, time, release_time FROM versions WHERE 1"
+        params = []
+        if type is not None:
+            query += " AND type = ?"
+            params.append(type)
+        if since is not None:
+            query += " AND release_time >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND release_time <= ?"
+            params.append(until)
+        query += " ORDER BY release_time DESC"
+
+        return [ManifestVersion(*row) for row in self.db.execute(query, params)]
+
+    # Fabric
+    def fabric_supports(self, minecraft_version: str) -> bool:
+        return (
+            self.db.execute(
+                "SELECT 1 FROM fabric_game WHERE version = ?", (minecraft_version,)
+            ).fetchone()
+            is not None
+        )
+
+    def has_fabric_loader(self, loader_version: str) -> bool:
+        return (
+            self.db.execute(
+                "SELECT 1 FROM fabric_loader WHERE version = ?", (loader_version,)
+            ).fetchone()
+            is not None
+        )
+
+    def latest_fabric_loader(
+        self, minecraft_version: str | None = None, stable: bool = False
+    ) -> str | None:
+        if minecraft_version is not None and not self.fabric_supports(
+            minecraft_version
+        ):
+            return None
+
+        row = self.db.execute(
+            "SELECT version FROM fabric_loader WHERE stable >= ? "
+            "ORDER BY position LIMIT 1",
+            (int(stable),),
+        ).fetchone()
+        return row[0] if row else None
+
+    # Forge
+    def forge_builds(self, minecraft_version: str) -> list[str]:
+        """Forge builds for a minecraft version, newest first."""
+        return [
+            row[0]
+            for row in self.db.execute(
+                "SELECT forge_version FROM forge WHERE minecraft_version = ? "
+                "ORDER BY position",
+                (minecraft_version,),
+            )
+        ]
+
+    def latest_forge(self, minecraft_version: str) -> str | None:
+        row = self.db.execute(
+            "SELECT forge_version FROM forge WHERE minecraft_version = ? "
+            "ORDER BY position LIMIT 1",
+            (minecraft_version,),
+        ).fetchone()
+        return row[0] if row else None
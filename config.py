@@ -72,8 +72,23 @@ class LauncherConfig:
         assets_dir: str = "assets",
         game_dir: str = "game",
         instances_dir: str = "instances",
+        store_dir: str = "store",
+        natives_dir: str = "natives",
         platform=_get_platform(),
         architecture=_get_architecture(),
+        download_backend: str = "threads",
+        download_workers_min: int = 2,
+        download_workers_max: int | None = None,
+        use_store: bool = True,
+        metadata_ttl: int = 3600,
+        offline: bool = False,
+        processor_workers: int | None = None,
+        mirrors: dict[str, list[str]] | None = None,
+        download_timeout: float = 30,
+        shared_roots: list[str] | None = None,
+        trace_file: str | None = None,
+        class_data_sharing: bool = False,
+        library_conflicts: str = "newest",
     ):
         self.minecraft_dir = minecraft_dir
         self.game_config = game_config
@@ -85,14 +100,15 @@ class LauncherConfig:
         self.assets_dir = os.path.join(self.minecraft_dir, assets_dir)
         self.game_dir = os.path.join(self.minecraft_dir, game_dir)
         self.instances_dir = os.path.join(self.minecraft_dir, instances_dir)
+        # Content-addressed files shared by libraries, runtimes and instances
+        self.store_dir = os.path.join(self.minecraft_dir, store_dir)
+        # Extracted natives, one directory per native jar
+        self.natives_dir = os.path.join(self.minecraft_dir, natives_dir)
         # Files
         self.version_manifest = os.path.join(
             self.minecraft_dir, "version_manifest.json"
         )
         # Fabric
-        self.fabric_installers = os.path.join(
-            self.minecraft_dir, "fabric_installers.json"
-        )
         self.fabric_loaders = os.path.join(self.minecraft_dir, "fabric_loaders.json")
         self.fabric_minecraft_versions = os.path.join(
             self.minecraft_dir, "fabric_minecraft_versions.json"
@@ -101,13 +117,88 @@ class LauncherConfig:
         # Forge
         self.forge_manifest = os.path.join(self.minecraft_dir, "forge_manifest.xml")
 
+        # Indexed versions of all of the above
+        self.catalog = os.path.join(self.minecraft_dir, "catalog.db")
+
+        # Size, mtime and inode of every verified file, to skip hashing it again
+        self.stamps = os.path.join(self.minecraft_dir, "stamps.db")
+
         # Platform
         self.platform = platform
         self.architecture = architecture
 
+        # Downloads ("threads" or "asyncio")
+        self.download_backend = download_backend
+        # Bounds for the adaptive number of concurrent downloads,
+        # a max of None uses the backend's default
+        self.download_workers_min = download_workers_min
+        self.download_workers_max = download_workers_max
+
+        # Materialise files with a known sha1 from the store
+        self.use_store = use_store
+
+        # Seconds before cached metadata (manifests, version lists) is
+        # revalidated, offline mode only uses what is cached
+        self.metadata_ttl = metadata_ttl
+        self.offline = offline
+
+        # Forge install processors run at once, None uses one per core
+        self.processor_workers = processor_workers
+
+        # URL prefixes that replace download origins, for example
+        # {"https://libraries.minecraft.net/": ["https://mirror.example/maven/"]}.
+        # List the origin among its mirrors to keep it as a fallback.
+        self.mirrors = mirrors if mirrors is not None else {}
+        # Seconds a connection may stall before the next mirror is tried
+        self.download_timeout = download_timeout
+
+        # Read-only minecraft directories with the same layout (e.g. a
+        # network mount), searched in order before anything is downloaded
+        self.shared_roots = shared_roots if shared_roots is not None else []
+
+        # Spans of every install and launch step are appended here as JSON lines
+        self.trace_file = trace_file
+
+        # Start the JVM from an AppCDS archive of the version's classpath,
+        # recorded on the first launch (java 16+ runtimes only)
+        self.class_data_sharing = class_data_sharing
+
+        # Which of two versions of a library goes on the classpath, the
+        # "newest" or the inheriting version's ("child")
+        self.library_conflicts = library_conflicts
+
     minecraft_dir: str
     profile_dir: str
 
+    def shared_path(self, path: str) -> str | None:
+        """The first copy of a file under minecraft_dir in the shared roots."""
+        rel_path = os.path.relpath(path, self.minecraft_dir)
+        if rel_path.startswith(os.pardir):
+            return None
+
+        for root in self.shared_roots:
+            shared = os.path.join(root, rel_path)
+            if os.path.exists(shared):
+                return shared
+
+        return None
+
+    def local_path(self, path: str) -> str | None:
+        """The counterpart under minecraft_dir of a file in a shared root."""
+        for root in self.shared_roots:
+            rel_path = os.path.relpath(path, root)
+            if not rel_path.startswith(os.pardir):
+                return os.path.join(self.minecraft_dir, rel_path)
+
+        return None
+
+    def resolve(self, path: str) -> str:
+        """A file under minecraft_dir, or its shared copy if it's missing."""
+        if not self.shared_roots or os.path.exists(path):
+            return path
+
+        return self.shared_path(path) or path
+
     def platform_clean(self) -> str:
         return (
             self.platform.replace("-x64", "").replace("-x86", "").replace("-arm64", "")
@@ -3,13 +3,25 @@ import shutil
 
 from config import DEFAULT_CONFIG, LauncherConfig
 import launcher
+import catalog
 import libraries
-from util import download_file, extract_zipfile, get_jar_mainclass, zipfile_exists
+import tracing
+from util import (
+    download_file,
+    download_metadata,
+    extract_zipfile,
+    file_matches,
+    get_jar_mainclass,
+    zipfile_exists,
+)
 import tempfile
 import os
 import zipfile
 import json
 import subprocess
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import xml.etree.ElementTree as ET
 import versions
 
@@ -19,20 +31,110 @@ FORGE_VERSION_MANIFEST_URL = (
 
 
 def _download_version_manifest(config: LauncherConfig = DEFAULT_CONFIG):
-    download_file(FORGE_VERSION_MANIFEST_URL, config.forge_manifest)
+    download_metadata(FORGE_VERSION_MANIFEST_URL, config.forge_manifest, config)
 
 
 def _download_installer(
     minecraft_version: str,
     forge_version: str,
     path: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
 ):
     download_file(
         f"https://maven.minecraftforge.net/net/minecraftforge/forge/{minecraft_version}-{forge_version}/forge-{minecraft_version}-{forge_version}-installer.jar",
         path,
+        config=config,
     )
 
 
+def _resolve_arg(value: str, arguments: dict, config: LauncherConfig = DEFAULT_CONFIG):
+    v = arguments.get(value, value)
+    if v.startswith("[") and v.endswith("]"):
+        return libraries.get_library_path(v[1:-1], config)
+    # Literal values are quoted
+    if len(v) > 1 and v.startswith("'") and v.endswith("'"):
+        return v[1:-1]
+
+    return v
+
+
+def _load_processor_cache(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_processor_cache(path: str, cache: dict):
+    with open(path, "w") as f:
+        json.dump(cache, f)
+
+
+def _outputs_done(outputs: dict[str, str], cached: dict) -> bool:
+    """Check the outputs of a processor against their expected sha1.
+
+    Outputs recorded in the cache with the same size and mtime aren't hashed
+    again.
+    """
+    for path, sha1 in outputs.items():
+        if not os.path.isfile(path):
+            return False
+
+        st = os.stat(path)
+        if cached.get(path) == [sha1, st.st_size, st.st_mtime_ns]:
+            continue
+
+        if not file_matches(path, sha1):
+            return False
+
+    return True
+
+
+def _stamp_outputs(outputs: dict[str, str]) -> dict:
+    stamps = {}
+    for path, sha1 in outputs.items():
+        st = os.stat(path)
+        stamps[path] = [sha1, st.st_size, st.st_mtime_ns]
+
+    return stamps
+
+
+# Arguments provided by the installer, processors only read them
+READ_ONLY_ARGUMENTS = {
+    "{MINECRAFT_JAR}",
+    "{SIDE}",
+    "{INSTALLER}",
+    "{BINPATCH}",
+    "{ROOT}",
+}
+
+
+def _processor_refs(p: dict, arguments: dict, config: LauncherConfig = DEFAULT_CONFIG):
+    """Files and data a processor reads or writes, as resolved paths."""
+    refs = set()
+    for a in [*p["args"], *p.get("outputs", {}).keys()]:
+        if a in READ_ONLY_ARGUMENTS:
+            continue
+        if (a.startswith("{") and a.endswith("}") and a in arguments) or (
+            a.startswith("[") and a.endswith("]")
+        ):
+            refs.add(_resolve_arg(a, arguments, config))
+
+    return refs
+
+
+def _run_processor(command: list[str], log_path: str) -> tuple[int, float]:
+    start = time.monotonic()
+    with tracing.span("processor", log=os.path.basename(log_path)) as span:
+        with open(log_path, "w") as log:
+            returncode = subprocess.run(
+                command, stdout=log, stderr=subprocess.STDOUT
+            ).returncode
+        span.set(returncode=returncode)
+
+    return (returncode, time.monotonic() - start)
+
+
 def _run_processors(
     processors: list,
     data: dict,
@@ -42,18 +144,34 @@ def _run_processors(
     side: str,
     config: LauncherConfig = DEFAULT_CONFIG,
 ):
+    with tracing.span("processors"):
+        _run_processors_dag(
+            processors, data, version, installer_path, lzma_path, side, config
+        )
+
+
+def _run_processors_dag(
+    processors: list,
+    data: dict,
+    version: versions.Version,
+    installer_path: str,
+    lzma_path: str,
+    side: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+):
+    """Run the install processors, independent ones in parallel.
+
+    A processor depends on every earlier processor it shares a data key or
+    file with, the rest run concurrently on up to `config.processor_workers`
+    JVMs. The output of each processor goes to its own log file.
+    """
     arguments = {}
 
     for key, value in data.items():
         client_value = value.get(side)
         # server_value = value.get("server")
 
-        if client_value.startswith("[") and client_value.endswith("]"):
-            arguments[f"{{{key}}}"] = libraries.get_library_path(
-                client_value[1:-1], config
-            )
-        else:
-            arguments[f"{{{key}}}"] = client_value
+        arguments[f"{{{key}}}"] = _resolve_arg(client_value, {}, config)
 
     arguments |= {
         "{MINECRAFT_JAR}": os.path.join(
@@ -64,48 +182,127 @@ def _run_processors(
         "{BINPATCH}": lzma_path,
     }
 
+    version_dir = os.path.join(
+        config.versions_dir, config.platform, version.version_name
+    )
+
+    # Verified outputs of the processors that already ran for this version
+    cache_path = os.path.join(version_dir, "processors.json")
+    cache = _load_processor_cache(cache_path)
+
+    log_dir = os.path.join(version_dir, "processor_logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    java_exe = config.resolve(
+        os.path.join(
+            config.runtime_dir,
+            config.platform,
+            version.java_version,
+            "bin",
+            "java" + (".exe" if config.platform.startswith("windows") else ""),
+        )
+    )
+
+    if config.game_config.custom_java_path:
+        java_exe = config.game_config.custom_java_path
+
+    classpath_sep = ";" if config.platform.startswith("windows") else ":"
+
     with tempfile.TemporaryDirectory() as root:
         arguments["{ROOT}"] = root
 
-        for p in processors:
+        jobs = []
+        for i, p in enumerate(processors):
             # Skip unwanted processors
             if side not in p.get("sides", [side]):
                 continue
 
+            key = hashlib.sha1(json.dumps(p, sort_keys=True).encode()).hexdigest()
+            outputs = {
+                _resolve_arg(k, arguments, config): _resolve_arg(v, arguments, config)
+                for k, v in p.get("outputs", {}).items()
+            }
+
+            # Skip processors whose outputs are already there
+            if outputs and _outputs_done(outputs, cache.get(key, {})):
+                print(f"Skipping processor {p['jar']}, outputs are up to date")
+                cache[key] = _stamp_outputs(outputs)
+                continue
+
             jar_path = libraries.get_library_path(p["jar"], config)
 
             # Create the classpath
-            classpath = ""
-            for c in p["classpath"]:
-                classpath += libraries.get_library_path(c, config)
-                classpath += ";" if config.platform_clean == "windows" else ":"
-
-            classpath += jar_path
+            classpath = [libraries.get_library_path(c, config) for c in p["classpath"]]
+            classpath.append(jar_path)
 
             mainclass = get_jar_mainclass(jar_path)
             assert mainclass is not None
 
-            args = []
-            for a in p["args"]:
-                v = arguments.get(a, a)
-                if v.startswith("[") and v.endswith("]"):
-                    args.append(libraries.get_library_path(v[1:-1], config))
-                else:
-                    args.append(v)
-
-            java_exe = os.path.join(
-                config.runtime_dir,
-                config.platform,
-                version.java_version,
-                "bin",
-                "java" + (".exe" if config.platform.startswith("windows") else ""),
+            args = [_resolve_arg(a, arguments, config) for a in p["args"]]
+            command = [java_exe, "-cp", classpath_sep.join(classpath), mainclass, *args]
+
+            log_name = f"{i:02d}-{p['jar'].split(':')[1]}.log"
+            jobs.append(
+                (
+                    p,
+                    key,
+                    outputs,
+                    command,
+                    os.path.join(log_dir, log_name),
+                    _processor_refs(p, arguments, config),
+                )
             )
 
-            if config.game_config.custom_java_path:
-                java_exe = config.game_config.custom_java_path
+        # Processors each job has to wait for
+        waiting_on = [
+            {i for i in range(j) if jobs[i][5] & jobs[j][5]} for j in range(len(jobs))
+        ]
 
-            print(p, args)
-            subprocess.call([java_exe, "-cp", classpath, mainclass, *args])
+        failed = []
+        started = set()
+        workers = config.processor_workers or os.cpu_count() or 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+
+            def submit_ready():
+                for j in range(len(jobs)):
+                    if j not in started and not waiting_on[j] and not failed:
+                        started.add(j)
+                        print(f"Running processor {jobs[j][0]['jar']}")
+                        running[
+                            tracing.submit(
+                                executor, _run_processor, jobs[j][3], jobs[j][4]
+                            )
+                        ] = j
+
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    j = running.pop(future)
+                    p, key, outputs, _, log_path, _ = jobs[j]
+                    returncode, seconds = future.result()
+
+                    if returncode != 0:
+                        print(f"Processor {p['jar']} failed, see {log_path}")
+                        failed.append(p["jar"])
+                        continue
+
+                    print(f"Processor {p['jar']} finished in {seconds:.1f}s")
+                    if outputs and _outputs_done(outputs, {}):
+                        cache[key] = _stamp_outputs(outputs)
+                        _save_processor_cache(cache_path, cache)
+
+                    for w in waiting_on:
+                        w.discard(j)
+
+                submit_ready()
+
+    _save_processor_cache(cache_path, cache)
+
+    if failed:
+        raise Exception(f"Forge processors failed: {', '.join(failed)}")
 
 
 def install(
@@ -113,9 +310,25 @@ def install(
     forge_version: str | None = None,
     config: LauncherConfig = DEFAULT_CONFIG,
 ) -> str:
-    # TODO: Check if version is supported
-    # TODO: Implement automatic version selection
-    assert forge_version
+    with tracing.root(
+        "install", config, version=minecraft_version, forge=forge_version
+    ):
+        return _install(minecraft_version, forge_version, config)
+
+
+def _install(
+    minecraft_version: str,
+    forge_version: str | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+) -> str:
+    version_catalog = catalog.Catalog(config, sources=("forge",))
+    builds = version_catalog.forge_builds(minecraft_version)
+    version_catalog.close()
+
+    if not forge_version:
+        # Newest build for this minecraft version
+        forge_version = builds[0] if builds else None
+    assert forge_version in builds
 
     version_id = f"{minecraft_version}-{forge_version}"
     version_name = f"forge-{version_id}"
@@ -127,7 +340,7 @@ def install(
     with tempfile.TemporaryDirectory() as tmpdir:
         installer = os.path.join(tmpdir, "installer.jar")
 
-        _download_installer(minecraft_version, forge_version, installer)
+        _download_installer(minecraft_version, forge_version, installer, config)
 
         with zipfile.ZipFile(installer) as zf:
             with zf.open("install_profile.json") as f:
@@ -205,6 +418,7 @@ def install(
                 installer,
                 lzma_path,
                 "client",
+                config,
             )
 
     return f"forge-{minecraft_version}-{forge_version}"
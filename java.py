@@ -1,5 +1,5 @@
 from config import LauncherConfig, DEFAULT_CONFIG
-from util import download_file, download_files
+from util import DownloadBatch, DownloadJournal, download_file, download_metadata
 import json
 import os
 import stat
@@ -8,41 +8,23 @@ JAVA_MANIFEST = "https://launchermeta.mojang.com/v1/products/java-runtime/2ec0cc
 
 
 def _download_java_manifest(config: LauncherConfig = DEFAULT_CONFIG):
-    download_file(JAVA_MANIFEST, os.path.join(config.runtime_dir, "runtimes.json"))
-
-
-def download_java(version: str, config: LauncherConfig = DEFAULT_CONFIG):
-    if not os.path.exists(os.path.join(config.runtime_dir, "runtimes.json")):
-        _download_java_manifest(config)
-
-    raw_runtimes = None
-    with open(os.path.join(config.runtime_dir, "runtimes.json"), "r") as rm:
-        raw_runtimes = json.loads(rm.read())
-
-    if version not in raw_runtimes["gamecore"].keys():
-        print(f'Unknown java runtime name: "{version}"')
-        return -1
-
-    java_json = raw_runtimes[config.platform][version]
-    if len(java_json) == 0:
-        print(f'"{version}" isn\'t supported on {config.platform}')
-        return -1
-
-    java_files_manifest = os.path.join(
-        config.runtime_dir, config.platform, version, f"{version}.json"
+    download_metadata(
+        JAVA_MANIFEST, os.path.join(config.runtime_dir, "runtimes.json"), config
     )
-    if os.path.exists(java_files_manifest):
-        print(f"{version} is already installed!")
-        return 0
 
-    download_file(java_json[0]["manifest"]["url"], java_files_manifest)
 
-    raw_files = None
-    with open(java_files_manifest, "r") as jf:
+def _runtime_files(version: str, config: LauncherConfig = DEFAULT_CONFIG):
+    """The files, links and executables listed by an installed runtime's
+    manifest. Its directories are created on the way."""
+    runtime_dir = os.path.join(config.runtime_dir, config.platform, version)
+    with open(os.path.join(runtime_dir, f"{version}.json"), "r") as jf:
         raw_files = json.loads(jf.read())
 
     urls = []
     paths = []
+    hashes = []
+    sizes = []
+    compressions = []
     links = []
     executables = []
 
@@ -50,26 +32,37 @@ def download_java(version: str, config: LauncherConfig = DEFAULT_CONFIG):
         value = raw_files["files"][file]
 
         if value["type"] == "directory":
-            os.makedirs(
-                os.path.join(config.runtime_dir, config.platform, version, file),
-                exist_ok=True,
-            )
+            os.makedirs(os.path.join(runtime_dir, file), exist_ok=True)
             continue
 
         if value["type"] == "link":
             links.append((file, value["target"]))
             continue
 
-        urls.append(value["downloads"]["raw"]["url"])
-        paths.append(os.path.join(config.runtime_dir, config.platform, version, file))
+        # Prefer the compressed download, it is verified against the raw file
+        raw = value["downloads"]["raw"]
+        if "lzma" in value["downloads"]:
+            urls.append(value["downloads"]["lzma"]["url"])
+            compressions.append("lzma")
+        else:
+            urls.append(raw["url"])
+            compressions.append(None)
+        paths.append(os.path.join(runtime_dir, file))
+        hashes.append(raw.get("sha1"))
+        sizes.append(raw.get("size"))
 
         if value["executable"]:
-            executables.append(
-                os.path.join(config.runtime_dir, config.platform, version, file)
-            )
+            executables.append(os.path.join(runtime_dir, file))
+
+    return (urls, paths, hashes, sizes, compressions), links, executables
 
-    download_files(urls, paths, desc="Downloading java")
 
+def _setup_runtime(
+    version: str,
+    links: list[tuple[str, str]],
+    executables: list[str],
+    config: LauncherConfig = DEFAULT_CONFIG,
+):
     # Chmod executables
     for exe in executables:
         os.chmod(
@@ -81,12 +74,90 @@ def download_java(version: str, config: LauncherConfig = DEFAULT_CONFIG):
             | stat.S_IROTH
             | stat.S_IEXEC,
         )
-        pass
 
     # Create links
     for dest, target in links:
         file = os.path.join(config.runtime_dir, config.platform, version, dest)
-        if os.path.exists(file):
+        if os.path.lexists(file):
             print(f"Link {os.path.basename(file)} already exists!")
             continue
         os.symlink(os.path.join(os.path.dirname(file), target), file)
+
+
+def download_java(
+    version: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    batch: DownloadBatch | None = None,
+):
+    """Install a java runtime.
+
+    With a batch, the runtime files are only queued and set up once they
+    are all downloaded.
+    """
+    _download_java_manifest(config)
+
+    raw_runtimes = None
+    with open(os.path.join(config.runtime_dir, "runtimes.json"), "r") as rm:
+        raw_runtimes = json.loads(rm.read())
+
+    if version not in raw_runtimes["gamecore"].keys():
+        print(f'Unknown java runtime name: "{version}"')
+        return -1
+
+    java_json = raw_runtimes[config.platform][version]
+    if len(java_json) == 0:
+        print(f'"{version}" isn\'t supported on {config.platform}')
+        return -1
+
+    java_files_manifest = os.path.join(
+        config.runtime_dir, config.platform, version, f"{version}.json"
+    )
+    journal = DownloadJournal(
+        os.path.join(config.runtime_dir, config.platform, version, f"{version}.journal")
+    )
+    if os.path.exists(java_files_manifest) and not journal.pending():
+        print(f"{version} is already installed!")
+        return 0
+
+    # A complete runtime in a shared root is used where it is
+    shared_manifest = config.shared_path(java_files_manifest)
+    if (
+        not os.path.exists(java_files_manifest)
+        and shared_manifest is not None
+        and not DownloadJournal(
+            shared_manifest.removesuffix(".json") + ".journal"
+        ).pending()
+    ):
+        print(f"{version} is installed in {os.path.dirname(shared_manifest)}")
+        return 0
+
+    journal.begin()
+    download_file(java_json[0]["manifest"]["url"], java_files_manifest, config=config)
+
+    files, links, executables = _runtime_files(version, config)
+    urls, paths, hashes, sizes, compressions = files
+
+    def finish():
+        _setup_runtime(version, links, executables, config)
+        journal.finish()
+
+    own_batch = batch is None
+    if own_batch:
+        batch = DownloadBatch(config)
+
+    batch.add(
+        urls,
+        paths,
+        hashes=hashes,
+        sizes=sizes,
+        compressions=compressions,
+        journal=journal,
+        store=True,
+        on_complete=finish,
+        phase="java",
+    )
+
+    if own_batch:
+        batch.run("Downloading java")
+
+    return 0
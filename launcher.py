@@ -1,12 +1,15 @@
 import json
-from util import download_file, remove_duplicates
-from manifest import VersionManifest
+from util import DownloadBatch, DownloadJournal
+import catalog
 import versions
 import java
 import assets
 import libraries
+import tracing
 from config import LauncherConfig, DEFAULT_CONFIG
 import subprocess
+import hashlib
+import re
 import os
 
 
@@ -15,22 +18,48 @@ def _install(
 ) -> versions.Version:
     version_dir = os.path.join(config.versions_dir, config.platform, version_name)
 
-    version = versions.Version(version_name)
+    version = versions.Version(version_name, config)
+
+    # Left behind by an install that didn't finish
+    journal = DownloadJournal(os.path.join(version_dir, "install.journal"))
 
-    if os.path.exists(os.path.join(version_dir, "client.jar")) and not overwrite:
+    if (
+        os.path.exists(os.path.join(version_dir, "client.jar"))
+        and not overwrite
+        and not journal.pending()
+    ):
         print("Version is already installed.")
         return version
 
-    download_file(version.client_url, os.path.join(version_dir, "client.jar"))
+    journal.begin()
+
+    # Every file of the version goes through a single download queue
+    batch = DownloadBatch(config)
+
+    urls = [version.client_url]
+    paths = [os.path.join(version_dir, "client.jar")]
+    hashes = [version.client_sha1]
+    sizes = [version.client_size]
     if version.server_url:
-        download_file(version.server_url, os.path.join(version_dir, "server.jar"))
+        urls.append(version.server_url)
+        paths.append(os.path.join(version_dir, "server.jar"))
+        hashes.append(version.server_sha1)
+        sizes.append(version.server_size)
+    batch.add(urls, paths, hashes=hashes, sizes=sizes, journal=journal, phase="client")
+
+    with tracing.span("plan"):
+        java.download_java(version.java_version, config, batch)
 
-    java.download_java(version.java_version, config)
+        assets.download_assets(
+            version.asset_index, version.asset_json_url, config, batch
+        )
 
-    assets.download_assets(version.asset_index, version.asset_json_url, config)
+        libraries.download_libraries(version.libraries, config, batch)
+        libraries.download_natives(version.natives, version_name, config, batch)
 
-    libraries.download_libraries(version.libraries, config)
-    libraries.download_natives(version.natives, version_name, config)
+    batch.run(f"Installing {version_name}")
+
+    journal.finish()
 
     return version
 
@@ -38,21 +67,31 @@ def _install(
 def install_version(
     version_id: str, config: LauncherConfig = DEFAULT_CONFIG
 ) -> versions.Version | None:
-    manifest = VersionManifest(config)
+    with tracing.root("install", config, version=version_id):
+        return _install_version(version_id, config)
+
+
+def _install_version(
+    version_id: str, config: LauncherConfig = DEFAULT_CONFIG
+) -> versions.Version | None:
+    version_catalog = catalog.Catalog(config, sources=("mojang",))
+    manifest_version = version_catalog.version(version_id)
+    version_catalog.close()
 
-    if version_id not in manifest.versions:
+    if manifest_version is None:
         print("This version doesn't exist!")
         return
 
     print(f"Installing {version_id}")
 
-    manifest[version_id]._download(
+    manifest_version._download(
         os.path.join(
             config.versions_dir,
             config.platform,
             version_id,
             f"{version_id}.json",
-        )
+        ),
+        config,
     )
 
     version = _install(version_id, config)
@@ -76,59 +115,119 @@ def launch_instance(name: str, config: LauncherConfig = DEFAULT_CONFIG):
     launch(version, custom_game_dir=os.path.join(config.game_dir, name), config=config)
 
 
-def launch(
-    version_name: str,
-    custom_game_dir: str | None = None,
-    config: LauncherConfig = DEFAULT_CONFIG,
-):
-    version_dir = os.path.join(config.versions_dir, config.platform, version_name)
-    if not os.path.exists(version_dir):
-        print("Version is not installed!")
-        return -1
+# Java 9+ reads arguments from @argfiles, used once the command gets this long
+ARGFILE_THRESHOLD = 8000
+
+# Bump when the compiled plan changes
+LAUNCH_PLAN_FORMAT = 3
+
+PLACEHOLDER = re.compile(r"\$\{([^}]+)\}")
+
+
+def _fill(template: str, values: dict[str, str]) -> str:
+    """Replace every ${placeholder} of a template in a single pass."""
+    return PLACEHOLDER.sub(lambda m: values.get(m.group(1), m.group(0)), template)
+
+
+def _quote_argfile(arg: str) -> str:
+    return '"' + arg.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _plan_inputs(version_name: str, game_dir: str, config: LauncherConfig) -> dict:
+    """Everything besides the version files that ends up in the command."""
+    game_config = config.game_config
+    return {
+        "format": LAUNCH_PLAN_FORMAT,
+        "version": version_name,
+        "game_dir": game_dir,
+        "minecraft_dir": config.minecraft_dir,
+        # The directories can be moved out of minecraft_dir one by one
+        "assets_dir": config.assets_dir,
+        "library_dir": config.library_dir,
+        "runtime_dir": config.runtime_dir,
+        "versions_dir": config.versions_dir,
+        "platform": config.platform,
+        "architecture": config.architecture,
+        "username": game_config.username,
+        "launcher_name": game_config.launcher_name,
+        "launcher_version": game_config.launcher_version,
+        "custom_jvm_args": game_config.custom_jvm_args,
+        "custom_game_args": game_config.custom_game_args,
+        "custom_java_path": game_config.custom_java_path,
+        "legacy_sounds": game_config.legacy_sounds,
+        "library_conflicts": config.library_conflicts,
+        # Paths of the plan can point into the shared roots
+        "shared_roots": config.shared_roots,
+    }
+
+
+def _launch_plan_path(
+    version_name: str, game_dir: str, config: LauncherConfig = DEFAULT_CONFIG
+) -> str:
+    # One plan per game directory and settings of the version
+    inputs = _plan_inputs(version_name, game_dir, config)
+    plan_key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+    return os.path.join(
+        config.versions_dir,
+        config.platform,
+        version_name,
+        "launch",
+        f"{plan_key[:16]}.json",
+    )
 
-    version = versions.Version(version_name, config)
 
-    game_dir = (
-        custom_game_dir
-        if custom_game_dir is not None
-        else os.path.join(config.game_dir, version_name)
-    )
+def compile_launch_plan(
+    version_name: str, game_dir: str, config: LauncherConfig = DEFAULT_CONFIG
+) -> dict:
+    """Resolve the full command that launches a version.
 
-    java_exe = os.path.join(
-        config.runtime_dir,
-        config.platform,
-        version.java_version,
-        "bin",
-        "java" + (".exe" if config.platform.startswith("windows") else ""),
+    The classpath, the rule-filtered arguments and the java path are resolved
+    once, and every placeholder is filled in a single pass.
+    """
+    version_dir = os.path.join(config.versions_dir, config.platform, version_name)
+    with tracing.span("resolve"):
+        version = versions.Version(version_name, config)
+
+    java_exe = config.resolve(
+        os.path.join(
+            config.runtime_dir,
+            config.platform,
+            version.java_version,
+            "bin",
+            "java" + (".exe" if config.platform.startswith("windows") else ""),
+        )
     )
 
     if config.game_config.custom_java_path:
         java_exe = config.game_config.custom_java_path
 
     classpath_sep = ";" if config.platform.startswith("windows") else ":"
-    classpath = ""
-
-    for lib in set(version.libraries):
-        if not libraries.check_rules(lib.rules, config):
-            continue
-        classpath += (
-            os.path.join(config.library_dir, config.platform, lib.path) + classpath_sep
-        )
+    # Libraries missing locally are used from the shared roots
+    with tracing.span("classpath") as span:
+        classpath = [
+            config.resolve(os.path.join(config.library_dir, config.platform, lib.path))
+            for lib in libraries.resolve_libraries(version.libraries, config)
+        ]
+        span.set(entries=len(classpath))
 
     if version.inherit_version and version.has_own_jvm_args:
         # Modern modded version (e.g. Forge 1.13+) manages its own class loading
         # via BootstrapLauncher and the library directory - no client.jar needed
-        classpath = classpath.rstrip(classpath_sep)
+        pass
     elif version.inherit_version:
         # Old modded version (e.g. Forge 1.12.2) needs the parent's client.jar
-        classpath += os.path.join(
-            config.versions_dir,
-            config.platform,
-            version.inherit_version,
-            "client.jar",
+        classpath.append(
+            config.resolve(
+                os.path.join(
+                    config.versions_dir,
+                    config.platform,
+                    version.inherit_version,
+                    "client.jar",
+                )
+            )
         )
     else:
-        classpath += os.path.join(version_dir, "client.jar")
+        classpath.append(config.resolve(os.path.join(version_dir, "client.jar")))
 
     jvm_args: list[str] = []
 
@@ -154,24 +253,17 @@ def launch(
     # Append the user defined jvm args
     jvm_args.extend(config.game_config.custom_jvm_args)
 
-    for i in range(len(jvm_args)):
-        jvm_args[i] = jvm_args[i].replace(
-            "${natives_directory}", os.path.join(version_dir, "natives")
-        )
-        jvm_args[i] = jvm_args[i].replace(
-            "${launcher_name}", config.game_config.launcher_name
-        )
-        jvm_args[i] = jvm_args[i].replace(
-            "${launcher_version}", config.game_config.launcher_version
-        )
-        jvm_args[i] = jvm_args[i].replace("${classpath}", classpath)
-
+    jvm_values = {
+        "natives_directory": os.path.join(version_dir, "natives"),
+        "launcher_name": config.game_config.launcher_name,
+        "launcher_version": config.game_config.launcher_version,
+        "classpath": classpath_sep.join(classpath),
         # Forge
-        jvm_args[i] = jvm_args[i].replace(
-            "${library_directory}", os.path.join(config.library_dir, config.platform)
-        )
-        jvm_args[i] = jvm_args[i].replace("${classpath_separator}", classpath_sep)
-        jvm_args[i] = jvm_args[i].replace("${version_name}", version.version_id)
+        "library_directory": os.path.join(config.library_dir, config.platform),
+        "classpath_separator": classpath_sep,
+        "version_name": version.version_id,
+    }
+    jvm_args = [_fill(arg, jvm_values) for arg in jvm_args]
 
     game_args: list[str] = []
     for arg, value in version.game_args.items():
@@ -188,43 +280,200 @@ def launch(
     # Append the user defined game args
     game_args.extend(config.game_config.custom_game_args)
 
-    for i in range(len(game_args)):
-        game_args[i] = game_args[i].replace(
-            "${clientid}", "clientid"
-        )  # TODO: Implement auth - clientid
-        game_args[i] = game_args[i].replace(
-            "${auth_xuid}", "auth_xuid"
-        )  # TODO: Implement auth - auth_xuid
-        game_args[i] = game_args[i].replace(
-            "${auth_player_name}", config.game_config.username
-        )  # Offline mode
-        game_args[i] = game_args[i].replace("${version_name}", version_name)
-        game_args[i] = game_args[i].replace("${game_directory}", game_dir)
-        game_args[i] = game_args[i].replace("${assets_root}", config.assets_dir)
-        game_args[i] = game_args[i].replace("${assets_index_name}", version.asset_index)
-        game_args[i] = game_args[i].replace(
-            "${auth_uuid}", "f81d4fae-7dec-11d0-a765-00a0c91e6bf6"
-        )  # TODO: Implement auth - auth_uuid
-        game_args[i] = game_args[i].replace(
-            "${auth_access_token}", "auth_access_token"
-        )  # TODO: Implement auth - auth_access_token
-        game_args[i] = game_args[i].replace(
-            "${user_type}", "user_type"
-        )  # TODO: Implement auth - user_type
-        game_args[i] = game_args[i].replace(
-            "${user_properties}", "user_properties"
-        )  # TODO: Figure out what this does (1.8 only?)
-        game_args[i] = game_args[i].replace("${version_type}", version_name)
-        game_args[i] = game_args[i].replace("${quickPlayPath}", "logs")
-
-    print(java_exe)
-    print(jvm_args)
-    print(version.main_class)
-    print(game_args)
-    os.makedirs(os.path.join(config.game_dir, version_name), exist_ok=True)
+    game_values = {
+        "clientid": "clientid",  # TODO: Implement auth - clientid
+        "auth_xuid": "auth_xuid",  # TODO: Implement auth - auth_xuid
+        "auth_player_name": config.game_config.username,  # Offline mode
+        "version_name": version_name,
+        "game_directory": game_dir,
+        "assets_root": config.assets_dir,
+        "assets_index_name": version.asset_index,
+        # TODO: Implement auth - auth_uuid
+        "auth_uuid": "f81d4fae-7dec-11d0-a765-00a0c91e6bf6",
+        # TODO: Implement auth - auth_access_token
+        "auth_access_token": "auth_access_token",
+        "user_type": "user_type",  # TODO: Implement auth - user_type
+        # TODO: Figure out what this does (1.8 only?)
+        "user_properties": "user_properties",
+        "version_type": version_name,
+        "quickPlayPath": "logs",
+    }
+    game_args = [_fill(arg, game_values) for arg in game_args]
+
+    # Long classpaths go through an @argfile, which java 8 (jre-legacy)
+    # doesn't understand. A custom java could be anything, so leave it be.
+    argfile = None
+    if (
+        sum(len(a) for a in jvm_args) > ARGFILE_THRESHOLD
+        and version.java_version != "jre-legacy"
+        and not config.game_config.custom_java_path
+    ):
+        argfile = _launch_plan_path(version_name, game_dir, config).removesuffix(
+            ".json"
+        )
+        argfile += ".args"
+        os.makedirs(os.path.dirname(argfile), exist_ok=True)
+        with open(argfile, "w") as f:
+            f.write("\n".join(_quote_argfile(a) for a in jvm_args) + "\n")
+        jvm_args = [f"@{argfile}"]
+
+    return {
+        "inputs": _plan_inputs(version_name, game_dir, config),
+        "stamps": versions.stamp_files(version.chain),
+        "java": java_exe,
+        "java_version": version.java_version,
+        "classpath": classpath,
+        "jvm_args": jvm_args,
+        "main_class": version.main_class,
+        "game_args": game_args,
+        "argfile": argfile,
+    }
+
+
+def _load_launch_plan(
+    path: str, inputs: dict, config: LauncherConfig = DEFAULT_CONFIG
+) -> dict | None:
+    """Load a compiled plan if neither its inputs nor the version files changed."""
+    try:
+        with open(path, "r") as f:
+            plan = json.load(f)
+
+        if plan["inputs"] != inputs:
+            return None
+        stamps = [tuple(s) for s in plan["stamps"]]
+        if versions.stamp_files([path for path, _, _ in stamps]) != stamps:
+            return None
+        if plan["argfile"] and not os.path.exists(plan["argfile"]):
+            return None
+        # A shared root that was unmounted, or a file installed locally since
+        for file in [plan["java"], *plan["classpath"]]:
+            if not os.path.exists(file):
+                return None
+            local = config.local_path(file)
+            if local is not None and os.path.exists(local):
+                return None
+    except Exception:
+        return None
+
+    return plan
+
+
+def _cds_archive_path(
+    plan: dict, config: LauncherConfig = DEFAULT_CONFIG
+) -> str | None:
+    """The class data sharing archive of a plan's java and classpath.
+
+    Java 8 (jre-legacy) can't record archives and a custom java could be
+    anything, so those launch without one.
+    """
+    if plan["java_version"] == "jre-legacy" or config.game_config.custom_java_path:
+        return None
+
+    # A new runtime or any changed jar gets a new archive
+    try:
+        stamps = versions.stamp_files([plan["java"], *plan["classpath"]])
+    except OSError:
+        return None
+    key = hashlib.sha1(json.dumps(stamps).encode()).hexdigest()
+
+    return os.path.join(
+        config.versions_dir,
+        config.platform,
+        plan["inputs"]["version"],
+        "cds",
+        f"{key[:16]}.jsa",
+    )
 
-    # Launch the game
-    subprocess.call(
-        [java_exe, *jvm_args, version.main_class, *game_args],
-        cwd=game_dir,
+
+def _save_cds_archive(archive: str, returncode: int):
+    """Keep the archive of a training launch if the game exited cleanly."""
+    recorded = archive + ".tmp"
+    if not os.path.exists(recorded):
+        return
+
+    if returncode != 0:
+        os.remove(recorded)
+        return
+
+    # Archives of the old classpaths are never used again
+    cds_dir = os.path.dirname(archive)
+    for name in os.listdir(cds_dir):
+        if name.endswith(".jsa"):
+            os.remove(os.path.join(cds_dir, name))
+
+    os.replace(recorded, archive)
+
+
+def launch(
+    version_name: str,
+    custom_game_dir: str | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+):
+    with tracing.root("launch", config, version=version_name):
+        return _launch(version_name, custom_game_dir, config)
+
+
+def _launch(
+    version_name: str,
+    custom_game_dir: str | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+):
+    version_dir = os.path.join(config.versions_dir, config.platform, version_name)
+    if not os.path.exists(version_dir):
+        print("Version is not installed!")
+        return -1
+
+    game_dir = (
+        custom_game_dir
+        if custom_game_dir is not None
+        else os.path.join(config.game_dir, version_name)
     )
+
+    plan_path = _launch_plan_path(version_name, game_dir, config)
+
+    with tracing.span("plan") as span:
+        plan = _load_launch_plan(
+            plan_path, _plan_inputs(version_name, game_dir, config), config
+        )
+        span.set(cached=plan is not None)
+        if plan is None:
+            plan = compile_launch_plan(version_name, game_dir, config)
+            os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+            with open(plan_path, "w") as f:
+                json.dump(plan, f)
+
+    print(plan["java"])
+    print(plan["jvm_args"])
+    print(plan["main_class"])
+    print(plan["game_args"])
+    os.makedirs(game_dir, exist_ok=True)
+
+    cds_args = []
+    archive = None
+    if config.class_data_sharing:
+        archive = _cds_archive_path(plan, config)
+    if archive is not None and os.path.exists(archive):
+        cds_args = [f"-XX:SharedArchiveFile={archive}"]
+    elif archive is not None:
+        # Training launch, the JVM writes the archive when the game exits
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+        cds_args = [f"-XX:ArchiveClassesAtExit={archive}.tmp"]
+
+    # Launch the game
+    with tracing.span("spawn", cds=bool(cds_args)):
+        process = subprocess.Popen(
+            [
+                plan["java"],
+                *cds_args,
+                *plan["jvm_args"],
+                plan["main_class"],
+                *plan["game_args"],
+            ],
+            cwd=game_dir,
+        )
+    with tracing.span("game") as span:
+        returncode = process.wait()
+        span.set(returncode=returncode)
+
+    if archive is not None and not os.path.exists(archive):
+        _save_cds_archive(archive, returncode)
@@ -1,13 +1,18 @@
 from config import LauncherConfig, DEFAULT_CONFIG
-from util import download_files
+from util import DownloadBatch, version_key
 from zipfile import ZipFile
+import hashlib
 import shutil
-from pathlib import Path
-import tempfile
+import store
 import os
 
+# Skipped when extracting natives, besides the library's own extract rules
+NATIVES_EXCLUDE = ["META-INF/"]
+
 
 class Rule:
+    __slots__ = ("action", "os", "arch", "version", "features")
+
     action: bool
     os: str
     arch: str
@@ -23,12 +28,27 @@ class Rule:
 
 
 class Library:
+    __slots__ = (
+        "group",
+        "name",
+        "version",
+        "url",
+        "path",
+        "rules",
+        "classifier",
+        "sha1",
+        "size",
+    )
+
     name: str
     version: str
     url: str
     path: str
     rules: list[Rule]
     classifier: str | None
+    sha1: str | None
+    size: int | None
+    group: str
 
     def __init__(
         self,
@@ -38,34 +58,84 @@ class Library:
         path: str,
         classifier: str | None = None,
         rules=[],
+        sha1: str | None = None,
+        size: int | None = None,
+        group: str = "",
     ) -> None:
+        self.group = group
         self.name = name
         self.version = version
         self.url = url
         self.path = path
         self.classifier = classifier
         self.rules = rules
+        self.sha1 = sha1
+        self.size = size
+
+    @property
+    def key(self) -> tuple[str, str, str | None]:
+        """The maven group:artifact:classifier, which only one version of
+        can be on the classpath."""
+        return (self.group, self.name, self.classifier)
+
+    def __eq__(self, value: object, /) -> bool:
+        if isinstance(value, Library):
+            return (self.key, self.version, self.path) == (
+                value.key,
+                value.version,
+                value.path,
+            )
+
+        return False
+
+    def __hash__(self) -> int:
+        return hash((self.key, self.version, self.path))
 
     def __repr__(self) -> str:
         return f"{self.name}-{self.version}"
 
 
 class Native:
+    __slots__ = (
+        "url",
+        "name",
+        "version",
+        "platform",
+        "rules",
+        "sha1",
+        "size",
+        "exclude",
+    )
+
     url: str
     name: str
     version: str
     platform: str
     rules: list[Rule]
     classifier = None
+    sha1: str | None
+    size: int | None
+    exclude: list[str]
 
     def __init__(
-        self, name: str, version: str, url: str, platform: str, rules=[]
+        self,
+        name: str,
+        version: str,
+        url: str,
+        platform: str,
+        rules=[],
+        sha1: str | None = None,
+        size: int | None = None,
+        exclude: list[str] = NATIVES_EXCLUDE,
     ) -> None:
         self.name = name
         self.version = version
         self.url = url
         self.rules = rules
         self.platform = platform
+        self.sha1 = sha1
+        self.size = size
+        self.exclude = exclude
 
     def __repr__(self) -> str:
         return f"{self.name}-{self.version}"
@@ -114,51 +184,174 @@ def get_library_path(lib: str, config: LauncherConfig = DEFAULT_CONFIG):
     return libpath
 
 
-def download_libraries(libraries, config: LauncherConfig = DEFAULT_CONFIG):
-    urls = []
-    paths = []
+def resolve_libraries(
+    libraries: list[Library], config: LauncherConfig = DEFAULT_CONFIG
+) -> list[Library]:
+    """The libraries used on this platform, one per group:artifact:classifier.
+
+    Of conflicting versions `config.library_conflicts` keeps the newest one
+    or the one listed last, which is the inheriting version's. It takes the
+    place of the first one listed.
+    """
+    resolved: dict[tuple, Library] = {}
+    for lib in libraries:
+        if not check_rules(lib.rules, config):
+            continue
 
+        current = resolved.get(lib.key)
+        if (
+            current is None
+            or config.library_conflicts == "child"
+            or version_key(lib.version) >= version_key(current.version)
+        ):
+            resolved[lib.key] = lib
+
+    return list(resolved.values())
+
+
+def library_files(
+    libraries, config: LauncherConfig = DEFAULT_CONFIG
+) -> list[tuple[str, str, str | None, int | None]]:
+    """The (url, path, sha1, size) of every library to install.
+
+    Every listed version is included, since forge processors and module
+    paths name their jars exactly. Only a file listed twice is dropped.
+    """
+    files = {}
     for lib in libraries:
         if not check_rules(lib.rules, config) or not lib.url:
             continue
 
-        urls.append(lib.url)
-        paths.append(os.path.join(config.library_dir, config.platform, lib.path))
+        path = os.path.join(config.library_dir, config.platform, lib.path)
+        files.setdefault(path, (lib.url, path, lib.sha1, lib.size))
 
-    download_files(urls, paths, desc="Downloading libraries")
+    return list(files.values())
 
 
-def download_natives(
-    natives: list[Native], version_name: str, config: LauncherConfig = DEFAULT_CONFIG
+def download_libraries(
+    libraries,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    batch: DownloadBatch | None = None,
 ):
     urls = []
     paths = []
+    hashes = []
+    sizes = []
+
+    for url, path, sha1, size in library_files(libraries, config):
+        urls.append(url)
+        paths.append(path)
+        hashes.append(sha1)
+        sizes.append(size)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        for native in natives:
-            if native.platform == config.platform_clean() and check_rules(
-                native.rules, config
+    own_batch = batch is None
+    if own_batch:
+        batch = DownloadBatch(config)
+
+    batch.add(urls, paths, hashes=hashes, sizes=sizes, store=True, phase="libraries")
+
+    if own_batch:
+        batch.run("Downloading libraries")
+
+
+def _native_key(native: Native) -> str:
+    if native.sha1:
+        return native.sha1.lower()
+
+    return hashlib.sha1(native.url.encode()).hexdigest()
+
+
+def _extract_native(jar_path: str, dest_dir: str, exclude: list[str]):
+    """Stream the files of a native jar into a flat directory."""
+    tmp_dir = dest_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    with ZipFile(jar_path, "r") as jar:
+        for info in jar.infolist():
+            if info.is_dir() or info.filename.startswith(tuple(exclude)):
+                continue
+
+            with (
+                jar.open(info) as src,
+                open(
+                    os.path.join(tmp_dir, os.path.basename(info.filename)), "wb"
+                ) as dst,
             ):
-                if not native.url:
-                    continue
-                urls.append(native.url)
-                paths.append(
-                    os.path.join(tmpdir, f"{native.name.replace(':', '_')}.jar")
-                )
+                shutil.copyfileobj(src, dst)
 
-        download_files(urls, paths, desc="Downloading natives")
+    os.replace(tmp_dir, dest_dir)
 
-        for nat_path in paths:
-            with ZipFile(nat_path, "r") as jar:
-                jar.extractall(os.path.join(tmpdir, nat_path[: len(nat_path) - 4]))
 
-            natives_dir = os.path.join(
-                config.versions_dir, config.platform, version_name, "natives/"
-            )
-            os.makedirs(natives_dir, exist_ok=True)
+def download_natives(
+    natives: list[Native],
+    version_name: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    batch: DownloadBatch | None = None,
+):
+    """Install the natives of a version.
+
+    Each native jar is extracted once into `config.natives_dir/<jar sha1>`,
+    which every version using it links its natives from. With a batch, the
+    jars are extracted as soon as they are all downloaded.
+    """
+    urls = []
+    paths = []
+    hashes = []
+    sizes = []
+
+    wanted = []
+    for native in natives:
+        if native.platform == config.platform_clean() and check_rules(
+            native.rules, config
+        ):
+            if not native.url:
+                continue
+            wanted.append(native)
+
+            key = _native_key(native)
+            if os.path.isdir(config.resolve(os.path.join(config.natives_dir, key))):
+                continue
+
+            urls.append(native.url)
+            paths.append(os.path.join(config.natives_dir, f"{key}.jar"))
+            hashes.append(native.sha1)
+            sizes.append(native.size)
+
+    natives_dir = os.path.join(
+        config.versions_dir, config.platform, version_name, "natives"
+    )
+
+    def extract():
+        os.makedirs(natives_dir, exist_ok=True)
+
+        for native in wanted:
+            key = _native_key(native)
+            cache_dir = config.resolve(os.path.join(config.natives_dir, key))
+
+            if not os.path.isdir(cache_dir):
+                jar_path = os.path.join(config.natives_dir, f"{key}.jar")
+                _extract_native(jar_path, cache_dir, native.exclude)
+                os.remove(jar_path)
+
+            for f in os.listdir(cache_dir):
+                store.link_file(
+                    os.path.join(cache_dir, f), os.path.join(natives_dir, f)
+                )
+
+    own_batch = batch is None
+    if own_batch:
+        batch = DownloadBatch(config)
+
+    batch.add(
+        urls,
+        paths,
+        hashes=hashes,
+        sizes=sizes,
+        store=True,
+        on_complete=extract,
+        phase="natives",
+    )
 
-            for f in Path(nat_path[: len(nat_path) - 4]).glob("**/*"):
-                file = os.path.join(nat_path[: len(nat_path) - 4], f)
-                if not os.path.isfile(file):
-                    continue
-                shutil.copy(file, natives_dir)
+    if own_batch:
+        batch.run("Downloading natives")
@@ -2,6 +2,7 @@ import fabric
 import forge
 import launcher
 import mrpack
+import verify
 from config import DEFAULT_CONFIG, DEFAULT_GAME_CONFIG
 import sys
 
@@ -27,8 +28,17 @@ if len(sys.argv) > 2:
         version = fabric.install(sys.argv[2], config=config)
         print(version)
     elif sys.argv[1] == "forge":
-        version = forge.install(sys.argv[2], sys.argv[3], config=config)
+        forge_version = sys.argv[3] if len(sys.argv) > 3 else None
+        version = forge.install(sys.argv[2], forge_version, config=config)
         print(version)
     elif sys.argv[1] == "mrpack":
         _, instance = mrpack.install(sys.argv[2], config=config)
         print(instance)
+    elif sys.argv[1] == "verify":
+        verify.verify_version(sys.argv[2], config=config)
+    elif sys.argv[1] == "repair":
+        verify.verify_version(sys.argv[2], config=config, repair=True)
+    elif sys.argv[1] == "verify-instance":
+        verify.verify_instance(sys.argv[2], config=config)
+    elif sys.argv[1] == "repair-instance":
+        verify.verify_instance(sys.argv[2], config=config, repair=True)
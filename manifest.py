@@ -1,7 +1,6 @@
 import json
 from config import DEFAULT_CONFIG, LauncherConfig
-from util import download_file
-import os
+from util import download_file, download_metadata
 
 VERSION_MANIFEST = "https://launchermeta.mojang.com/mc/game/version_manifest.json"
 
@@ -20,8 +19,8 @@ class ManifestVersion:
         self.time = time
         self.release_time = release_time
 
-    def _download(self, path: str):
-        download_file(self.url, path)
+    def _download(self, path: str, config: LauncherConfig = DEFAULT_CONFIG):
+        download_file(self.url, path, config=config)
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -46,9 +45,7 @@ class VersionManifest:
 
     def __init__(self, config: LauncherConfig = DEFAULT_CONFIG):
         self.config = config
-        if not os.path.exists(config.version_manifest):
-            print(config.version_manifest)
-            self._download_version_manifest()
+        self._download_version_manifest()
 
         raw_manifest = None
         with open(config.version_manifest, "r") as vm:
@@ -64,17 +61,20 @@ class VersionManifest:
                     v["id"], v["type"], v["url"], v["time"], v["releaseTime"]
                 )
             )
+        self._by_id = {v.id: v for v in self.versions}
+
+    def __contains__(self, i) -> bool:
+        return str(i) in self._by_id
 
     def __getitem__(self, i):
         if isinstance(i, int):
             return self.versions[i]
         elif isinstance(i, str):
-            for version in self.versions:
-                if version.id == i:
-                    return version
+            if i in self._by_id:
+                return self._by_id[i]
             raise KeyError(f"Version with ID '{i}' not found.")
 
         raise TypeError("Index must be an integer or a string.")
 
     def _download_version_manifest(self):
-        download_file(VERSION_MANIFEST, self.config.version_manifest)
+        download_metadata(VERSION_MANIFEST, self.config.version_manifest, self.config)
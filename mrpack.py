@@ -1,13 +1,18 @@
 import os
-import shutil
-import tempfile
 import zipfile
 import json
 from config import LauncherConfig, DEFAULT_CONFIG
 import forge
 import fabric
 import launcher
-from util import download_files
+import store
+import tracing
+from util import DownloadJournal, download_files, extract_zipfile, file_matches
+from concurrent.futures import ThreadPoolExecutor
+
+# Override folders whose files are never edited in place, so they can be
+# hardlinked from the store. Everything else (configs, options) is copied.
+SHARED_OVERRIDES = ("mods/", "resourcepacks/", "shaderpacks/")
 
 
 def _install_mod_loader(
@@ -25,7 +30,89 @@ def _install_mod_loader(
             raise Exception(f"Unimplemented mod loader: {m}")
 
 
+def _game_path(game_dir: str, rel_path: str) -> str:
+    """Join a path from the pack to the game directory.
+
+    Absolute paths and paths leaving the game directory are rejected, as the
+    mrpack format requires.
+    """
+    parts = rel_path.replace("\\", "/").split("/")
+    if (
+        not rel_path
+        or parts[0] == ""
+        or ":" in parts[0]
+        or ".." in parts
+        or os.path.isabs(rel_path)
+    ):
+        raise Exception(f"Unsafe path in mrpack: {rel_path}")
+
+    dest = os.path.join(game_dir, *parts)
+    root = os.path.realpath(game_dir)
+    if os.path.commonpath([root, os.path.realpath(dest)]) != root:
+        raise Exception(f"Unsafe path in mrpack: {rel_path}")
+
+    return dest
+
+
+def _copy_overrides(
+    zf: zipfile.ZipFile,
+    prefix: str,
+    game_dir: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+):
+    for info in zf.infolist():
+        if info.is_dir() or not info.filename.startswith(prefix):
+            continue
+
+        rel_path = info.filename.removeprefix(prefix)
+        dest = _game_path(game_dir, rel_path)
+
+        if not config.use_store or not rel_path.startswith(SHARED_OVERRIDES):
+            extract_zipfile(zf, info.filename, dest)
+            continue
+
+        with zf.open(info) as f:
+            sha1 = store.add_stream(f, config)
+        store.link_file(store.store_path(sha1, config), dest)
+
+
+def _install_game(
+    mc_version: str,
+    mod_loader: tuple[str, str] | None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+) -> str:
+    if mod_loader:
+        return _install_mod_loader(
+            mc_version, mod_loader[1], mod_loader[0], config=config
+        )
+
+    v = launcher.install_version(mc_version, config=config)
+    assert v is not None
+    return v.version_name
+
+
+def _verify_files(paths: list[str], hashes: list[str | None]):
+    """Check pack files against their sha512 digests, in parallel.
+
+    Only used for files without a sha1, the others are verified while they
+    download or when they enter the store.
+    """
+    files = [(p, h) for p, h in zip(paths, hashes) if h is not None]
+
+    with ThreadPoolExecutor() as executor:
+        results = executor.map(lambda f: file_matches(f[0], sha512=f[1]), files)
+        for (path, _), ok in zip(files, results):
+            if not ok:
+                os.remove(path)
+                raise Exception(f"Hash mismatch: {path}")
+
+
 def install(mrpack: str, config: LauncherConfig = DEFAULT_CONFIG) -> tuple[str, str]:
+    with tracing.root("install", config, mrpack=os.path.basename(mrpack)):
+        return _install(mrpack, config)
+
+
+def _install(mrpack: str, config: LauncherConfig = DEFAULT_CONFIG) -> tuple[str, str]:
     with zipfile.ZipFile(mrpack) as zf:
         with zf.open("modrinth.index.json") as j:
             manifest = json.load(j)
@@ -39,47 +126,93 @@ def install(mrpack: str, config: LauncherConfig = DEFAULT_CONFIG) -> tuple[str,
                 continue
             mod_loader = (id, version)
 
-        if mod_loader:
-            version = _install_mod_loader(
-                mc_version, mod_loader[1], mod_loader[0], config=config
-            )
-        else:
-            v = launcher.install_version(mc_version, config=config)
-            assert v is not None
-            version = v.version_name
-
-        # Create instance
         name = manifest["name"]
         mrpack_version = manifest["versionId"]
 
-        instance_dir = os.path.join(config.instances_dir, name)
-        os.makedirs(instance_dir, exist_ok=True)
+        instance_dir = _game_path(config.instances_dir, name)
+        game_dir = _game_path(config.game_dir, name)
 
-        game_dir = os.path.join(config.game_dir, name)
+        # Reject the whole pack before anything is installed
+        for f in manifest["files"]:
+            _game_path(game_dir, f["path"])
+        for info in zf.infolist():
+            for prefix in ("overrides/", "client-overrides/"):
+                if not info.is_dir() and info.filename.startswith(prefix):
+                    _game_path(game_dir, info.filename.removeprefix(prefix))
+
+        os.makedirs(instance_dir, exist_ok=True)
         os.makedirs(game_dir, exist_ok=True)
 
-        with open(os.path.join(instance_dir, "instance.json"), "w") as d:
-            json.dump(
-                {"name": name, "version": mrpack_version, "minecraft": version}, d
+        # The game and the pack files don't depend on each other
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            game = tracing.submit(
+                executor, _install_game, mc_version, mod_loader, config
             )
 
-        urls, paths = [], []
+            journal = DownloadJournal(os.path.join(instance_dir, "install.journal"))
+            journal.begin()
+
+            urls, paths, hashes, sizes, sha512s = [], [], [], [], []
+            # Kept in the instance, to verify and repair its files later
+            files = []
+
+            for f in manifest["files"]:
+                path = f["path"]
+                downloads = f["downloads"]
+                if "env" in f:
+                    if f["env"]["client"] != "required":
+                        continue
+
+                # Every listed URL is a mirror of the same file
+                urls.append(downloads)
+                paths.append(_game_path(game_dir, path))
+                hashes.append(f.get("hashes", {}).get("sha1"))
+                if hashes[-1] is None:
+                    sha512s.append(f.get("hashes", {}).get("sha512"))
+                else:
+                    sha512s.append(None)
+                sizes.append(f.get("fileSize"))
+                files.append(
+                    {
+                        "path": path,
+                        "downloads": downloads,
+                        "sha1": hashes[-1],
+                        "size": sizes[-1],
+                    }
+                )
+
+            download_files(
+                urls,
+                paths,
+                desc="Downloading files",
+                hashes=hashes,
+                sizes=sizes,
+                config=config,
+                journal=journal,
+                store=True,
+            )
+            with tracing.span("verify", files=len(sha512s) - sha512s.count(None)):
+                _verify_files(paths, sha512s)
 
-        for f in manifest["files"]:
-            path = f["path"]
-            downloads = f["downloads"]
-            if "env" in f:
-                if f["env"]["client"] != "required":
-                    continue
-
-            urls.append(downloads[0])
-            paths.append(os.path.join(game_dir, path))
-
-        download_files(urls, paths, desc="Downloading files")
-        with tempfile.TemporaryDirectory() as tmpdir:
-            zf.extractall(tmpdir)
-            shutil.copytree(
-                os.path.join(tmpdir, "overrides"), game_dir, dirs_exist_ok=True
+            # Client overrides take precedence over the shared ones
+            with tracing.span("overrides"):
+                _copy_overrides(zf, "overrides/", game_dir, config)
+                _copy_overrides(zf, "client-overrides/", game_dir, config)
+
+            version = game.result()
+
+        # Create instance
+        with open(os.path.join(instance_dir, "instance.json"), "w") as d:
+            json.dump(
+                {
+                    "name": name,
+                    "version": mrpack_version,
+                    "minecraft": version,
+                    "files": files,
+                },
+                d,
             )
 
+        journal.finish()
+
     return (version, name)
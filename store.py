@@ -0,0 +1,99 @@
+from config import LauncherConfig, DEFAULT_CONFIG
+import hashlib
+import shutil
+import uuid
+import os
+
+# ioctl request to clone a file's extents on copy-on-write filesystems (Linux)
+FICLONE = 0x40049409
+
+
+def store_path(sha1: str, config: LauncherConfig = DEFAULT_CONFIG) -> str:
+    sha1 = sha1.lower()
+    return os.path.join(config.store_dir, sha1[:2], sha1)
+
+
+def has(sha1: str, size: int | None = None, config: LauncherConfig = DEFAULT_CONFIG):
+    """Check if a file is in the store.
+
+    Files are only added once verified, so the size is all that's checked.
+    """
+    path = store_path(sha1, config)
+    if not os.path.isfile(path):
+        return False
+
+    return size is None or os.path.getsize(path) == size
+
+
+def _reflink(src: str, dest: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError:
+            pass
+
+    os.remove(dest)
+    return False
+
+
+def link_file(src: str, dest: str, hardlink: bool = True, symlink: bool = False):
+    """Materialise `src` at `dest` as a hardlink, a reflink or a copy.
+
+    Hardlinks share the inode with the store, so files that get edited in
+    place (configs, options) should use `hardlink=False`. Read-only sources
+    on another filesystem can be symlinked instead of copied.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+    if os.path.lexists(dest):
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return
+        os.remove(dest)
+
+    if hardlink:
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+
+    if symlink:
+        try:
+            os.symlink(os.path.abspath(src), dest)
+            return
+        except OSError:
+            pass
+
+    if _reflink(src, dest):
+        return
+
+    shutil.copyfile(src, dest)
+
+
+def add_stream(stream, config: LauncherConfig = DEFAULT_CONFIG) -> str:
+    """Copy a readable binary stream into the store and return its sha1."""
+    tmp_dir = os.path.join(config.store_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    h = hashlib.sha1()
+    with open(tmp_path, "wb") as f:
+        for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+            h.update(chunk)
+            f.write(chunk)
+
+    sha1 = h.hexdigest()
+    path = store_path(sha1, config)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    return sha1
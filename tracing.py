@@ -0,0 +1,131 @@
+from config import LauncherConfig
+from contextlib import contextmanager
+import contextvars
+import threading
+import itertools
+import json
+import time
+
+# Called with the record of every finished span
+_sinks = []
+_sinks_lock = threading.Lock()
+
+_current: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+_ids = itertools.count(1)
+
+
+class Span:
+    """A timed step of an install or launch, nested under a parent span."""
+
+    __slots__ = ("name", "id", "parent", "start", "duration", "attrs", "_clock")
+
+    def __init__(self, name: str, parent: "Span | None", attrs: dict):
+        self.name = name
+        self.id = next(_ids)
+        self.parent = parent.id if parent is not None else None
+        self.start = time.time()
+        self.duration = 0.0
+        self.attrs = attrs
+        self._clock = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, value: float = 1):
+        """Add to a counter, like bytes or retries."""
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._clock
+        if _sinks:
+            record = self.record()
+            for sink in list(_sinks):
+                sink(record)
+
+    def record(self) -> dict:
+        return {
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent,
+            "start": self.start,
+            "duration": self.duration,
+            **self.attrs,
+        }
+
+
+class JsonLinesSink:
+    """Append every span as a line of JSON to a file."""
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.file = open(path, "a")
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def add_sink(sink):
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+def current() -> Span | None:
+    return _current.get()
+
+
+def start(name: str, parent: Span | None = None, **attrs) -> Span:
+    """Start a span that is finished explicitly and isn't made current."""
+    return Span(name, parent if parent is not None else _current.get(), attrs)
+
+
+@contextmanager
+def span(name: str, parent: Span | None = None, **attrs):
+    s = start(name, parent, **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=repr(e))
+        raise
+    finally:
+        _current.reset(token)
+        s.finish()
+
+
+@contextmanager
+def root(name: str, config: LauncherConfig, **attrs):
+    """Span of a top level operation, written to `config.trace_file` if set.
+
+    Nested under another span, this is a regular span.
+    """
+    sink = None
+    if config.trace_file and _current.get() is None:
+        sink = JsonLinesSink(config.trace_file)
+        add_sink(sink)
+
+    try:
+        with span(name, **attrs) as s:
+            yield s
+    finally:
+        if sink is not None:
+            remove_sink(sink)
+            sink.close()
+
+
+def submit(executor, function, *args, parent: Span | None = None):
+    """`executor.submit`, with the function running under the current span."""
+    context = contextvars.copy_context()
+    if parent is not None:
+        context.run(_current.set, parent)
+
+    return executor.submit(context.run, function, *args)
@@ -1,58 +1,1070 @@
+import asyncio
+import hashlib
+import json
+import lzma
+import threading
+import time
 import zipfile
 import requests
+import shutil
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 
 from tqdm import tqdm
 import os
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import LauncherConfig, DEFAULT_CONFIG
+import store as file_store
+import tracing
 
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_WORKERS = 5
+THREAD_DOWNLOAD_LIMIT = 32
+ASYNC_DOWNLOAD_LIMIT = 100
 
-def download_file(
-    url: str, dest_path: str, keep_bar: bool = True, overwrite: bool = False
+# Keep-alive sessions shared between the download threads, one per host
+_sessions: dict[str, tuple[requests.Session, int]] = {}
+_sessions_lock = threading.Lock()
+
+
+def version_key(version: str):
+    """Sort key for dotted versions like 52.0.16 or 10.13.4.1614-1.7.10."""
+    return [
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in version.replace("-", ".").split(".")
+    ]
+
+
+def _host(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url: str, pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """Return the pooled session for the host of a URL.
+
+    The session keeps up to `pool_size` connections alive, so every download
+    thread can reuse an open connection instead of a new TCP/TLS handshake.
+    """
+    host = _host(url)
+
+    with _sessions_lock:
+        session, size = _sessions.get(host, (None, 0))
+        # A session with a smaller pool is replaced, not closed, since other
+        # threads may still be using it
+        if session is not None and size >= pool_size:
+            return session
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions[host] = (session, pool_size)
+
+        return session
+
+
+class MirrorRanking:
+    """Measured latency and throughput of every download host.
+
+    A file that can come from several URLs is fetched from the host with the
+    lowest expected time, so a slow or failing host stops getting requests
+    while the others keep up.
+    """
+
+    # Weight of the newest measurement in the moving averages
+    ALPHA = 0.3
+    # File size the hosts are compared on
+    TYPICAL_SIZE = 512 * 1024
+    # Smaller downloads say more about latency than throughput
+    MIN_THROUGHPUT_SAMPLE = 64 * 1024
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # host -> [latency, throughput, failures]
+        self._hosts: dict[str, list[float]] = {}
+
+    def record(self, url: str, latency: float, nbytes: int, seconds: float):
+        with self._lock:
+            stats = self._hosts.setdefault(_host(url), [latency, 0.0, 0.0])
+            stats[0] += self.ALPHA * (latency - stats[0])
+            if nbytes >= self.MIN_THROUGHPUT_SAMPLE:
+                throughput = nbytes / max(seconds, 1e-3)
+                if stats[1]:
+                    stats[1] += self.ALPHA * (throughput - stats[1])
+                else:
+                    stats[1] = throughput
+            stats[2] /= 2
+
+    def record_failure(self, url: str):
+        with self._lock:
+            self._hosts.setdefault(_host(url), [0.0, 0.0, 0.0])[2] += 1
+
+    def _score(self, url: str) -> float:
+        stats = self._hosts.get(_host(url))
+        if stats is None:
+            # Unmeasured hosts are tried first
+            return 0.0
+
+        latency, throughput, failures = stats
+        transfer = self.TYPICAL_SIZE / throughput if throughput else 1.0
+        return (latency + transfer) * 4**failures
+
+    def rank(self, urls: list[str]) -> list[str]:
+        with self._lock:
+            return sorted(urls, key=self._score)
+
+
+_mirror_ranking = MirrorRanking()
+
+
+def mirror_urls(
+    urls: str | list[str], config: LauncherConfig = DEFAULT_CONFIG
+) -> list[str]:
+    """Every URL a file can be downloaded from, best first.
+
+    URLs of an origin in `config.mirrors` are rewritten to its mirrors, the
+    origin is only kept if it's listed among them.
+    """
+    if isinstance(urls, str):
+        urls = [urls]
+
+    candidates = []
+    for url in urls:
+        rewritten = [
+            m + url[len(origin) :]
+            for origin, mirrors in config.mirrors.items()
+            if url.startswith(origin)
+            for m in mirrors
+        ]
+        candidates.extend(rewritten or [url])
+
+    return _mirror_ranking.rank(remove_duplicates(candidates))
+
+
+class ConcurrencyController:
+    """AIMD controller for the number of downloads in flight.
+
+    The limit starts at DOWNLOAD_WORKERS and doubles while the measured
+    throughput keeps improving (slow start). After that it grows by one per
+    window that still improves throughput, is halved when a download has to
+    be retried and cut by a quarter when latency grows without a throughput
+    gain.
+    """
+
+    WINDOW_SECONDS = 2.0
+
+    def __init__(self, floor: int, ceiling: int):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = min(max(DOWNLOAD_WORKERS, self.floor), self.ceiling)
+        self.in_flight = 0
+
+        self._cond = threading.Condition()
+        self._slow_start = True
+        self._prev_throughput: float | None = None
+        self._prev_latency: float | None = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_files = 0
+        self._window_seconds = 0.0
+        self._window_errors = 0
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def release(self, nbytes: int = 0, seconds: float = 0.0):
+        with self._cond:
+            self.in_flight -= 1
+            # Files that were already on disk say nothing about the network
+            if nbytes > 0:
+                self._window_bytes += nbytes
+                self._window_files += 1
+                self._window_seconds += seconds
+                self._update()
+            self._cond.notify_all()
+
+    def record_error(self):
+        with self._cond:
+            self._window_errors += 1
+            self._update()
+            self._cond.notify_all()
+
+    def _update(self):
+        elapsed = time.monotonic() - self._window_start
+
+        if self._window_errors:
+            self.limit = max(self.floor, self.limit // 2)
+            self._slow_start = False
+            self._prev_throughput = None
+            self._reset_window()
+            return
+
+        if self._window_files < self.limit and elapsed < self.WINDOW_SECONDS:
+            return
+
+        throughput = self._window_bytes / max(elapsed, 1e-6)
+        latency = self._window_seconds / max(self._window_files, 1)
+
+        if self._prev_throughput is None or throughput > self._prev_throughput * 1.05:
+            if self._slow_start:
+                self.limit = min(self.ceiling, self.limit * 2)
+            else:
+                self.limit = min(self.ceiling, self.limit + 1)
+        elif self._prev_latency is not None and latency > self._prev_latency * 1.5:
+            self.limit = max(self.floor, self.limit * 3 // 4)
+            self._slow_start = False
+        else:
+            self._slow_start = False
+
+        self._prev_throughput = throughput
+        self._prev_latency = latency
+        self._reset_window()
+
+
+class DownloadJournal:
+    """Record of the files of an install batch that finished downloading.
+
+    The journal file exists while the batch is running, so an interrupted
+    install can be told apart from a finished one. Files listed in it are
+    skipped on a rerun without being hashed again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f.read().splitlines():
+                    if not line:
+                        continue
+                    size, file = line.split("\t", 1)
+                    self.done[file] = int(size)
+
+    def pending(self) -> bool:
+        return os.path.exists(self.path)
+
+    def begin(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, "a").close()
+
+    def is_done(self, file: str) -> bool:
+        return (
+            file in self.done
+            and os.path.isfile(file)
+            and os.path.getsize(file) == self.done[file]
+        )
+
+    def mark(self, file: str):
+        size = os.path.getsize(file)
+        with self._lock:
+            self.done[file] = size
+            with open(self.path, "a") as f:
+                f.write(f"{size}\t{file}\n")
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _hash_file(path: str, *hashes) -> int:
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            for h in hashes:
+                h.update(chunk)
+            size += len(chunk)
+
+    return size
+
+
+def file_matches(
+    path: str,
+    sha1: str | None = None,
+    size: int | None = None,
+    sha512: str | None = None,
 ):
-    """Download a single file from a URL."""
+    """Check a file on disk against its expected digests and size."""
+    if not os.path.isfile(path):
+        return False
+    if size is not None and os.path.getsize(path) != size:
+        return False
+
+    expected = [(hashlib.new(n), d) for n, d in (("sha1", sha1), ("sha512", sha512))]
+    expected = [(h, d) for h, d in expected if d is not None]
+    if expected:
+        _hash_file(path, *(h for h, _ in expected))
+        if any(h.hexdigest() != d.lower() for h, d in expected):
+            return False
+
+    return True
+
+
+def _link_shared(
+    path: str, sha1: str | None, size: int | None, config: LauncherConfig
+) -> bool:
+    """Link a missing file from the shared roots instead of downloading it.
+
+    The shared roots are trusted like the store, so only the size is checked
+    when it's known.
+    """
+    if not config.shared_roots or (sha1 is None and size is None):
+        return False
+    if os.path.exists(path):
+        return False
+
+    shared = config.shared_path(path)
+    if shared is None or not file_matches(shared, sha1 if size is None else None, size):
+        return False
+
+    file_store.link_file(shared, path, symlink=True)
+    return True
+
+
+def _resume_partial(part_path: str, size: int | None, resumable: bool = True):
+    """Hash what is already in a partial download and return the Range header."""
+    h = hashlib.sha1()
+    if not os.path.exists(part_path):
+        return (h, 0, {})
+
+    if not resumable:
+        os.remove(part_path)
+        return (h, 0, {})
+
+    if size is not None and os.path.getsize(part_path) > size:
+        os.remove(part_path)
+        return (h, 0, {})
+
+    offset = _hash_file(part_path, h)
+    return (h, offset, {"Range": f"bytes={offset}-"})
+
+
+def _finish_partial(
+    part_path: str,
+    dest_path: str,
+    h,
+    written: int,
+    sha1: str | None,
+    size: int | None,
+) -> bool:
+    """Move a verified partial download in place, or discard a corrupt one."""
+    if (size is None or written == size) and (
+        sha1 is None or h.hexdigest() == sha1.lower()
+    ):
+        os.replace(part_path, dest_path)
+        return True
+
+    print(f"\nHash mismatch, retrying: {os.path.basename(dest_path)}\n")
+    os.remove(part_path)
+    return False
+
+
+class _Retry(Exception):
+    """Try the next URL of a download."""
+
+
+class _DownloadAttempts:
+    """The tries of a file download, shared by both backends.
+
+    Each try goes to the best ranked URL that hasn't failed, resumes from the
+    partial file and is hashed while streaming. The backends only send the
+    request and read the body, reporting back through `response`, `write`,
+    `lost` and `finish`.
+    """
+
+    def __init__(
+        self,
+        url: str | list[str],
+        dest_path: str,
+        sha1: str | None,
+        size: int | None,
+        controller: ConcurrencyController | None,
+        compression: str | None,
+        config: LauncherConfig,
+        span: tracing.Span,
+    ):
+        self.dest_path = dest_path
+        self.part_path = dest_path + ".part"
+        self.sha1 = sha1
+        self.size = size
+        self.controller = controller
+        self.compression = compression
+        self.span = span
+
+        self.candidates = mirror_urls(url, config)
+        # URLs that answered with an error status
+        self.failed = []
+        self.attempts = max(DOWNLOAD_RETRIES, len(self.candidates))
+        self.tries = 0
+        self.received = 0
+        self.url = self.candidates[0]
+
+    def next(self) -> bool:
+        """Start the next try, if there is one left."""
+        if self.tries >= self.attempts:
+            return False
+
+        self.tries += 1
+        self.url = _mirror_ranking.rank(
+            [u for u in self.candidates if u not in self.failed] or self.candidates
+        )[0]
+        self.decompressor = (
+            lzma.LZMADecompressor() if self.compression == "lzma" else None
+        )
+        self.start, self.before = time.monotonic(), self.received
+        self.latency = 0.0
+        return True
+
+    def resume(self) -> dict:
+        """Pick up the partial file and return the headers of the request."""
+        self.h, self.written, headers = _resume_partial(
+            self.part_path, self.size, self.compression is None
+        )
+        self.resumed_from = self.written
+        return headers
+
+    def response(self, status: int) -> bool:
+        """Check the response status, True if the body has to be read."""
+        self.latency = time.monotonic() - self.start
+        self.span.set(
+            url=self.url, host=_host(self.url), status=status, latency=self.latency
+        )
+
+        if status == 416:
+            # The partial file already holds the whole file
+            return False
+
+        if status >= 400:
+            _mirror_ranking.record_failure(self.url)
+            self.failed.append(self.url)
+            if len(self.failed) < len(self.candidates):
+                self.span.add("retries")
+                raise _Retry()
+            print(f"\nFailed to download: {os.path.basename(self.dest_path)}\n")
+            raise Exception(f"Failed to download: {self.url}")
+
+        self.append = status == 206
+        if not self.append:
+            # The server ignored the Range header, start over
+            self.h, self.written = hashlib.sha1(), 0
+
+        return True
+
+    def open(self):
+        return open(self.part_path, "ab" if self.append else "wb")
+
+    def write(self, file, data: bytes):
+        self.received += len(data)
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+        self.h.update(data)
+        self.written += file.write(data)
+
+    def lost(self):
+        """The connection broke or stalled, the next try resumes."""
+        print(f"\nConnection lost, resuming: {os.path.basename(self.dest_path)}\n")
+        _mirror_ranking.record_failure(self.url)
+        self.span.add("retries")
+        if self.controller is not None:
+            self.controller.record_error()
+        if self.compression is None and self.written > self.resumed_from:
+            # Resuming a download that is making progress isn't a retry
+            self.tries -= 1
+
+    def finish(self) -> bool:
+        """Move the verified file in place, False if it has to be fetched again."""
+        if _finish_partial(
+            self.part_path, self.dest_path, self.h, self.written, self.sha1, self.size
+        ):
+            _mirror_ranking.record(
+                self.url,
+                self.latency,
+                self.received - self.before,
+                time.monotonic() - self.start - self.latency,
+            )
+            return True
+
+        _mirror_ranking.record_failure(self.url)
+        self.span.add("retries")
+        if self.controller is not None:
+            self.controller.record_error()
+        return False
+
+
+def download_file(
+    url: str | list[str],
+    dest_path: str,
+    keep_bar: bool = True,
+    overwrite: bool = False,
+    sha1: str | None = None,
+    size: int | None = None,
+    pool_size: int = DOWNLOAD_WORKERS,
+    controller: ConcurrencyController | None = None,
+    compression: str | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+) -> int:
+    """Download a single file from a URL, or the first of several that works.
+
+    If a sha1 digest or size is given, existing files are checked against them
+    and downloads are hashed while streaming to disk. Mismatching files are
+    removed and fetched again.
+
+    The data is written to `<dest_path>.part` and only renamed once complete,
+    an interrupted download is resumed from there with a Range request.
+
+    With `compression="lzma"` the data is decompressed while streaming and the
+    sha1/size refer to the decompressed file. Those downloads aren't resumed.
+
+    Every try goes to the best ranked URL (see mirror_urls), a URL that
+    fails or stalls for `config.download_timeout` is ranked down so the next
+    try uses another mirror.
+
+    Returns the number of bytes downloaded, retries are reported to the
+    controller if one is given.
+    """
+    with tracing.span("file", path=dest_path) as span:
+        received = _download_file(
+            url,
+            dest_path,
+            keep_bar,
+            overwrite,
+            sha1,
+            size,
+            pool_size,
+            controller,
+            compression,
+            config,
+            span,
+        )
+        span.set(bytes=received)
+        return received
+
+
+def _download_file(
+    url: str | list[str],
+    dest_path: str,
+    keep_bar: bool,
+    overwrite: bool,
+    sha1: str | None,
+    size: int | None,
+    pool_size: int,
+    controller: ConcurrencyController | None,
+    compression: str | None,
+    config: LauncherConfig,
+    span: tracing.Span,
+) -> int:
     if os.path.exists(dest_path) and not overwrite:
-        return
+        if (sha1 is None and size is None) or file_matches(dest_path, sha1, size):
+            span.set(cached=True)
+            return 0
+    elif not overwrite and _link_shared(dest_path, sha1, size, config):
+        span.set(shared=True)
+        return 0
     os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-    try:
-        response = requests.get(url, stream=True)
-        total_size = int(response.headers.get("content-length", 0))
-
-        if not response.ok:
-            raise requests.exceptions.MissingSchema()
-
-        with (
-            open(dest_path, "wb") as file,
-            tqdm(
-                desc=os.path.basename(dest_path),
-                total=total_size,
-                unit="B",
-                unit_scale=True,
-                unit_divisor=1024,
-                leave=keep_bar,
-            ) as bar,
+
+    if overwrite and os.path.exists(dest_path + ".part"):
+        os.remove(dest_path + ".part")
+
+    download = _DownloadAttempts(
+        url, dest_path, sha1, size, controller, compression, config, span
+    )
+    while download.next():
+        headers = download.resume()
+        try:
+            with get_session(download.url, pool_size).get(
+                download.url,
+                stream=True,
+                headers=headers,
+                timeout=config.download_timeout,
+            ) as response:
+                if download.response(response.status_code):
+                    total_size = int(response.headers.get("content-length", 0))
+
+                    with (
+                        download.open() as file,
+                        tqdm(
+                            desc=os.path.basename(dest_path),
+                            total=download.written + total_size,
+                            initial=download.written,
+                            unit="B",
+                            unit_scale=True,
+                            unit_divisor=1024,
+                            leave=keep_bar,
+                        ) as bar,
+                    ):
+                        for data in response.iter_content(chunk_size=1024):
+                            bar.update(len(data))
+                            download.write(file, data)
+        except _Retry:
+            continue
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+            lzma.LZMAError,
         ):
-            for data in response.iter_content(chunk_size=1024):
-                size = file.write(data)
-                bar.update(size)
-    except requests.exceptions.MissingSchema:
-        print(f"\nFailed to download: {os.path.basename(dest_path)}\n")
-        raise Exception(f"Failed to download: {url}")
-
-
-def download_files(urls: list[str], files: list[str], desc: str = "Downloading"):
-    """Download multiple files in parallel with a progress bar."""
-    with tqdm(total=len(urls), desc=desc) as overall_bar:
-        with ThreadPoolExecutor(max_workers=5) as executor:
+            download.lost()
+            continue
+
+        if download.finish():
+            return download.received
+
+    raise Exception(f"Failed to verify: {download.url}")
+
+
+def download_metadata(
+    url: str, dest_path: str, config: LauncherConfig = DEFAULT_CONFIG
+):
+    """Download a metadata file (manifest, version list) and keep it fresh.
+
+    The ETag/Last-Modified validators are kept in `<dest_path>.cache`. Once
+    the file is older than `config.metadata_ttl` it is revalidated with a
+    conditional request, so an unchanged file costs a single 304. In offline
+    mode, or when the host can't be reached, the cached file is used as is.
+    """
+    cache_path = dest_path + ".cache"
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+    if os.path.exists(dest_path):
+        if config.offline:
+            return
+        if time.time() - cache.get("checked", 0) < config.metadata_ttl:
+            return
+    elif config.offline:
+        raise Exception(f"Not cached, can't download in offline mode: {url}")
+
+    headers = {}
+    if os.path.exists(dest_path):
+        if "etag" in cache:
+            headers["If-None-Match"] = cache["etag"]
+        if "last_modified" in cache:
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    with tracing.span("metadata", path=dest_path) as span:
+        candidates = mirror_urls(url, config)
+        # URLs that answered with an error status
+        failed = []
+        attempts = max(DOWNLOAD_RETRIES, len(candidates))
+
+        for attempt in range(attempts):
+            source = _mirror_ranking.rank(
+                [u for u in candidates if u not in failed] or candidates
+            )[0]
+            try:
+                with get_session(source).get(
+                    source, headers=headers, timeout=config.download_timeout
+                ) as response:
+                    span.set(
+                        url=source, host=_host(source), status=response.status_code
+                    )
+                    if response.status_code == 304:
+                        pass
+                    elif not response.ok:
+                        _mirror_ranking.record_failure(source)
+                        span.add("retries")
+                        failed.append(source)
+                        if len(failed) < len(candidates):
+                            continue
+                        raise requests.exceptions.MissingSchema()
+                    else:
+                        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                        with open(dest_path + ".part", "wb") as f:
+                            f.write(response.content)
+                        os.replace(dest_path + ".part", dest_path)
+
+                        cache = {}
+                        if "ETag" in response.headers:
+                            cache["etag"] = response.headers["ETag"]
+                        if "Last-Modified" in response.headers:
+                            cache["last_modified"] = response.headers["Last-Modified"]
+                break
+            except requests.exceptions.MissingSchema:
+                print(f"\nFailed to download: {os.path.basename(dest_path)}\n")
+                raise Exception(f"Failed to download: {url}")
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout,
+            ):
+                _mirror_ranking.record_failure(source)
+                span.add("retries")
+                if attempt + 1 < attempts:
+                    continue
+                if not os.path.exists(dest_path):
+                    raise
+                print(
+                    f"\nUsing cached {os.path.basename(dest_path)}, host unreachable\n"
+                )
+                return
+
+    cache["checked"] = time.time()
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+
+
+def _download_file_controlled(
+    controller: ConcurrencyController,
+    config: LauncherConfig,
+    url: str | list[str],
+    dest_path: str,
+    sha1: str | None,
+    size: int | None,
+    compression: str | None,
+):
+    controller.acquire()
+    start = time.monotonic()
+    written = 0
+    try:
+        written = download_file(
+            url,
+            dest_path,
+            False,
+            False,
+            sha1,
+            size,
+            controller.ceiling,
+            controller,
+            compression,
+            config,
+        )
+    finally:
+        controller.release(written, time.monotonic() - start)
+
+
+class DownloadBatch:
+    """Downloads gathered from several install steps, run as one queue.
+
+    Every group of files added to the batch can have a callback, called as
+    soon as all of its files landed while the rest keep downloading. Each
+    group is traced as a span named after its phase, with its files nested
+    under it.
+    """
+
+    def __init__(self, config: LauncherConfig = DEFAULT_CONFIG):
+        self.config = config
+        self._groups = []
+
+    def add(
+        self,
+        urls: list[str | list[str]],
+        files: list[str],
+        hashes: list[str | None] | None = None,
+        sizes: list[int | None] | None = None,
+        compressions: list[str | None] | None = None,
+        journal: DownloadJournal | None = None,
+        store: bool = False,
+        on_complete=None,
+        phase: str = "files",
+    ):
+        hashes = hashes if hashes else [None] * len(urls)
+        sizes = sizes if sizes else [None] * len(urls)
+        compressions = compressions if compressions else [None] * len(urls)
+
+        jobs = [
+            job
+            for job in zip(urls, files, hashes, sizes, compressions)
+            if journal is None or not journal.is_done(job[1])
+        ]
+        self._groups.append(
+            (jobs, journal, store and self.config.use_store, on_complete, phase)
+        )
+
+    def run(self, desc: str = "Downloading"):
+        config = self.config
+
+        # Destinations waiting for each download, with the group they belong to
+        waiting: dict[str, list[tuple[str, int]]] = {}
+        pending = [0] * len(self._groups)
+        remaining = []
+        spans = [tracing.start(group[4]) for group in self._groups]
+
+        for i, (jobs, journal, store, _, _) in enumerate(self._groups):
+            for url, path, sha1, size, compression in jobs:
+                dest = path
+                if store and sha1 is not None:
+                    dest = file_store.store_path(sha1, config)
+
+                if dest in waiting:
+                    waiting[dest].append((path, i))
+                    pending[i] += 1
+                    continue
+
+                if dest != path:
+                    if not file_store.has(sha1, size, config) and file_matches(
+                        path, sha1, size
+                    ):
+                        # Adopt a file installed before the store existed
+                        file_store.link_file(path, dest)
+
+                    if file_store.has(sha1, size, config):
+                        file_store.link_file(dest, path)
+                        if journal is not None:
+                            journal.mark(path)
+                        spans[i].add("linked")
+                        continue
+
+                if _link_shared(path, sha1, size, config):
+                    if journal is not None:
+                        journal.mark(path)
+                    spans[i].add("linked")
+                    continue
+
+                waiting[dest] = [(path, i)]
+                pending[i] += 1
+                remaining.append((url, dest, sha1, size, compression))
+
+        for i in range(len(self._groups)):
+            spans[i].set(files=pending[i])
+
+        def complete(i: int):
+            on_complete = self._groups[i][3]
+            if on_complete is not None:
+                with tracing.span("setup", parent=spans[i]):
+                    on_complete()
+            spans[i].finish()
+
+        def on_done(dest: str):
+            for path, i in waiting[dest]:
+                if path != dest:
+                    file_store.link_file(dest, path)
+                journal = self._groups[i][1]
+                if journal is not None:
+                    journal.mark(path)
+
+                pending[i] -= 1
+                if pending[i] == 0:
+                    complete(i)
+
+        # Files are traced under the first group that needs them
+        parents = {dest: spans[waiters[0][1]] for dest, waiters in waiting.items()}
+
+        try:
+            for i in range(len(self._groups)):
+                if pending[i] == 0:
+                    complete(i)
+
+            _download_jobs(remaining, desc, config, on_done, parents)
+        except BaseException as e:
+            for i in range(len(self._groups)):
+                if pending[i] > 0:
+                    spans[i].set(error=repr(e))
+                    spans[i].finish()
+            raise
+        finally:
+            self._groups = []
+
+
+def download_files(
+    urls: list[str | list[str]],
+    files: list[str],
+    desc: str = "Downloading",
+    hashes: list[str | None] | None = None,
+    sizes: list[int | None] | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    journal: DownloadJournal | None = None,
+    compressions: list[str | None] | None = None,
+    store: bool = False,
+):
+    """Download multiple files in parallel with a progress bar.
+
+    Files that a journal lists as finished are skipped, and every file that
+    completes is recorded in it.
+
+    With `store`, files with a known sha1 are downloaded once into the
+    content-addressed store and hardlinked to their destinations.
+    """
+    batch = DownloadBatch(config)
+    batch.add(urls, files, hashes, sizes, compressions, journal, store)
+    batch.run(desc)
+
+
+def _download_jobs(
+    jobs: list[tuple[str | list[str], str, str | None, int | None, str | None]],
+    desc: str,
+    config: LauncherConfig,
+    on_done,
+    parents: dict[str, tracing.Span] | None = None,
+):
+    parents = parents if parents is not None else {}
+
+    if config.download_backend == "asyncio":
+        controller = ConcurrencyController(
+            config.download_workers_min,
+            config.download_workers_max or ASYNC_DOWNLOAD_LIMIT,
+        )
+        asyncio.run(
+            _download_files_async(jobs, desc, controller, config, on_done, parents)
+        )
+        return
+
+    controller = ConcurrencyController(
+        config.download_workers_min,
+        config.download_workers_max or THREAD_DOWNLOAD_LIMIT,
+    )
+
+    with tqdm(total=len(jobs), desc=desc) as overall_bar:
+        # Idle threads wait for the controller to hand out a slot
+        with ThreadPoolExecutor(max_workers=controller.ceiling) as executor:
             futures = {
-                executor.submit(download_file, url, path, False): path
-                for url, path in zip(urls, files)
+                tracing.submit(
+                    executor,
+                    _download_file_controlled,
+                    controller,
+                    config,
+                    *job,
+                    parent=parents.get(job[1]),
+                ): job[1]
+                for job in jobs
             }
             for future in as_completed(futures):
                 future.result()
+                on_done(futures[future])
                 overall_bar.update(1)
 
 
+async def _download_file_async(
+    session,
+    url: str | list[str],
+    dest_path: str,
+    sha1: str | None = None,
+    size: int | None = None,
+    controller: ConcurrencyController | None = None,
+    compression: str | None = None,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    span: tracing.Span | None = None,
+) -> int:
+    """Download a single file on the event loop, see download_file."""
+    import aiohttp
+
+    if span is None:
+        span = tracing.Span("file", None, {})
+
+    if os.path.exists(dest_path):
+        if (sha1 is None and size is None) or await asyncio.to_thread(
+            file_matches, dest_path, sha1, size
+        ):
+            span.set(cached=True)
+            return 0
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=config.download_timeout, sock_read=config.download_timeout
+    )
+
+    download = _DownloadAttempts(
+        url, dest_path, sha1, size, controller, compression, config, span
+    )
+    while download.next():
+        headers = await asyncio.to_thread(download.resume)
+        try:
+            async with session.get(
+                download.url, headers=headers, timeout=timeout
+            ) as response:
+                if download.response(response.status):
+                    with download.open() as file:
+                        async for data in response.content.iter_chunked(64 * 1024):
+                            download.write(file, data)
+        except _Retry:
+            continue
+        except (
+            aiohttp.ClientPayloadError,
+            aiohttp.ClientConnectionError,
+            asyncio.TimeoutError,
+            lzma.LZMAError,
+        ):
+            download.lost()
+            continue
+
+        if download.finish():
+            return download.received
+
+    raise Exception(f"Failed to verify: {download.url}")
+
+
+async def _download_files_async(
+    jobs: list[tuple[str | list[str], str, str | None, int | None, str | None]],
+    desc: str,
+    controller: ConcurrencyController,
+    config: LauncherConfig,
+    on_done,
+    parents: dict[str, tracing.Span],
+):
+    """Download multiple files from a single thread.
+
+    The number of requests in flight is set by the controller, bounded by
+    its ceiling.
+    """
+    # Only needed by the asyncio backend
+    import aiohttp
+
+    slots = asyncio.Condition()
+
+    async def download(
+        url: str | list[str],
+        path: str,
+        sha1: str | None,
+        size: int | None,
+        compression: str | None,
+    ):
+        async with slots:
+            await slots.wait_for(controller.try_acquire)
+
+        start = time.monotonic()
+        written = 0
+        try:
+            with tracing.span("file", parents.get(path), path=path) as span:
+                written = await _download_file_async(
+                    session,
+                    url,
+                    path,
+                    sha1,
+                    size,
+                    controller,
+                    compression,
+                    config,
+                    span,
+                )
+                span.set(bytes=written)
+        finally:
+            controller.release(written, time.monotonic() - start)
+            async with slots:
+                slots.notify_all()
+
+        return path
+
+    connector = aiohttp.TCPConnector(limit=controller.ceiling)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        with tqdm(total=len(jobs), desc=desc) as overall_bar:
+            tasks = [asyncio.create_task(download(*job)) for job in jobs]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    on_done(await task)
+                    overall_bar.update(1)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+
 def get_jar_mainclass(jar: str):
     zf = zipfile.ZipFile(jar)
 
@@ -88,6 +1100,9 @@ def zipfile_exists(zf: zipfile.ZipFile, path: str):
 
 def extract_zipfile(zf: zipfile.ZipFile, file: str, path: str):
     os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Writing in place would change a store file hardlinked there
+    if os.path.lexists(path):
+        os.remove(path)
     with zf.open(file, "r") as f:
         with open(path, "wb") as o:
-            o.write(f.read())
+            shutil.copyfileobj(f, o, 1024 * 1024)
@@ -0,0 +1,331 @@
+from config import LauncherConfig, DEFAULT_CONFIG
+from concurrent.futures import ThreadPoolExecutor
+from util import DownloadBatch, file_matches
+import versions
+import libraries
+import assets
+import java
+import mrpack
+import store
+import tracing
+import sqlite3
+import json
+import time
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stamps (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+"""
+
+
+class StampDB:
+    """Stat of every file whose sha1 was verified.
+
+    A file with the same size, mtime and inode as when it was hashed is
+    taken as unchanged.
+    """
+
+    def __init__(self, config: LauncherConfig = DEFAULT_CONFIG):
+        os.makedirs(os.path.dirname(config.stamps), exist_ok=True)
+        self.db = sqlite3.connect(config.stamps)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def unchanged(self, path: str, st: os.stat_result, sha1: str) -> bool:
+        row = self.db.execute(
+            "SELECT size, mtime_ns, inode, sha1 FROM stamps WHERE path = ?", (path,)
+        ).fetchone()
+        return row == (st.st_size, st.st_mtime_ns, st.st_ino, sha1)
+
+    def record(self, stamps: list[tuple[str, os.stat_result, str]]):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO stamps VALUES (?, ?, ?, ?, ?)",
+                [
+                    (path, st.st_size, st.st_mtime_ns, st.st_ino, sha1)
+                    for path, st, sha1 in stamps
+                ],
+            )
+
+    def forget(self, paths: list[str]):
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM stamps WHERE path = ?", [(p,) for p in paths]
+            )
+
+
+def _check(jobs: list[tuple], config: LauncherConfig = DEFAULT_CONFIG) -> list[tuple]:
+    """Return the jobs (url, path, sha1, size, compression, store) whose file
+    is bad.
+
+    Only files that changed since they were last verified are hashed, on
+    every core. Missing files found in the shared roots are trusted.
+    """
+    bad = []
+    to_hash = []
+
+    stamps = StampDB(config)
+    for job in jobs:
+        _, path, sha1, size, _, _ = job
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if config.shared_path(path) is None:
+                bad.append(job)
+            continue
+
+        if size is not None and st.st_size != size:
+            bad.append(job)
+        elif sha1 is not None and not stamps.unchanged(path, st, sha1.lower()):
+            to_hash.append((job, st))
+
+    with tracing.span("hash", files=len(to_hash)):
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(lambda j: file_matches(j[0][1], j[0][2]), to_hash)
+            verified = []
+            for (job, st), ok in zip(to_hash, results):
+                if ok:
+                    verified.append((job[1], st, job[2].lower()))
+                else:
+                    bad.append(job)
+
+    stamps.record(verified)
+    stamps.forget([job[1] for job in bad])
+    stamps.close()
+
+    print(
+        f"Checked {len(jobs)} files, hashed {len(to_hash)}, "
+        f"{len(bad)} missing or corrupt"
+    )
+
+    return bad
+
+
+def _repair(
+    bad: list[tuple],
+    desc: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    on_complete=None,
+):
+    """Download the bad files again as one batch, those installed through the
+    store are put back in it."""
+    for _, path, sha1, size, _, _ in bad:
+        if os.path.lexists(path):
+            os.remove(path)
+
+        # A hardlink shares the damage with its store copy
+        if sha1 is not None:
+            stored = store.store_path(sha1, config)
+            if os.path.exists(stored) and not file_matches(stored, sha1, size):
+                os.remove(stored)
+
+    batch = DownloadBatch(config)
+    groups = [
+        ([job for job in bad if job[5]], True),
+        ([job for job in bad if not job[5]], False),
+    ]
+    groups = [(jobs, use_store) for jobs, use_store in groups if jobs]
+    for i, (jobs, use_store) in enumerate(groups):
+        batch.add(
+            [job[0] for job in jobs],
+            [job[1] for job in jobs],
+            hashes=[job[2] for job in jobs],
+            sizes=[job[3] for job in jobs],
+            compressions=[job[4] for job in jobs],
+            store=use_store,
+            # The setup runs once, after the first group's files
+            on_complete=on_complete if i == 0 else None,
+            phase="repair",
+        )
+    batch.run(desc)
+
+
+def _runtime_jobs(component: str, config: LauncherConfig = DEFAULT_CONFIG):
+    """The files of an installed runtime and a function that sets up its
+    executables and missing links."""
+    manifest = os.path.join(
+        config.runtime_dir, config.platform, component, f"{component}.json"
+    )
+    if not os.path.exists(manifest):
+        # Runtimes in the shared roots are trusted, like their files
+        if config.shared_path(manifest) is None:
+            print(f"{component} isn't installed")
+        return [], None
+
+    files, links, executables = java._runtime_files(component, config)
+    runtime_dir = os.path.dirname(manifest)
+    missing_links = [
+        (dest, target)
+        for dest, target in links
+        if not os.path.lexists(os.path.join(runtime_dir, dest))
+    ]
+
+    def setup():
+        java._setup_runtime(component, missing_links, executables, config)
+
+    return [(*job, True) for job in zip(*files)], setup
+
+
+def _version_jobs(version: versions.Version, config: LauncherConfig = DEFAULT_CONFIG):
+    jobs = []
+
+    # Old modded versions also use the client.jar of the version they inherit
+    client_dirs = [version.version_name]
+    if version.inherit_version:
+        client_dirs.append(version.inherit_version)
+    for name in client_dirs:
+        jobs.append(
+            (
+                version.client_url,
+                os.path.join(config.versions_dir, config.platform, name, "client.jar"),
+                version.client_sha1,
+                version.client_size,
+                None,
+                False,
+            )
+        )
+
+    # The same files download_libraries installs, not just the classpath
+    for url, path, sha1, size in libraries.library_files(version.libraries, config):
+        jobs.append((url, path, sha1, size, None, True))
+
+    index_path = os.path.join(
+        config.assets_dir, "indexes", f"{version.asset_index}.json"
+    )
+    if not os.path.exists(config.resolve(index_path)):
+        jobs.append((version.asset_json_url, index_path, None, None, None, False))
+        return jobs
+
+    with open(config.resolve(index_path), "r") as f:
+        objects = json.load(f)["objects"]
+
+    # Several names can point to the same object
+    for h in dict.fromkeys(o["hash"] for o in objects.values()):
+        jobs.append(
+            (
+                f"{assets.ASSETS_URL}/{h[:2]}/{h}",
+                os.path.join(config.assets_dir, "objects", h[:2], h),
+                h,
+                None,
+                None,
+                False,
+            )
+        )
+
+    return jobs
+
+
+def _verify(
+    jobs: list[tuple],
+    runtime: str | None,
+    desc: str,
+    config: LauncherConfig = DEFAULT_CONFIG,
+    repair: bool = False,
+) -> list[str]:
+    setup = None
+    if runtime is not None:
+        runtime_jobs, setup = _runtime_jobs(runtime, config)
+        jobs = jobs + runtime_jobs
+
+    start = time.perf_counter()
+    with tracing.span("check", files=len(jobs)) as span:
+        bad = _check(jobs, config)
+        span.set(bad=len(bad))
+    print(f"Verified in {time.perf_counter() - start:.1f}s")
+
+    if repair and bad:
+        _repair(bad, desc, config, setup)
+    elif repair and setup is not None:
+        setup()
+
+    return [job[1] for job in bad]
+
+
+def verify_runtime(
+    component: str, config: LauncherConfig = DEFAULT_CONFIG, repair: bool = False
+) -> list[str]:
+    """Check every file of a java runtime, with `repair` the missing or
+    corrupt ones are downloaded again. Returns the bad files."""
+    with tracing.root("verify", config, runtime=component):
+        return _verify([], component, f"Repairing {component}", config, repair)
+
+
+def verify_version(
+    version_name: str, config: LauncherConfig = DEFAULT_CONFIG, repair: bool = False
+) -> list[str]:
+    """Check the client, libraries, assets and runtime of an installed
+    version, with `repair` the missing or corrupt files are downloaded again.
+    Returns the bad files."""
+    version_dir = os.path.join(config.versions_dir, config.platform, version_name)
+    if not os.path.exists(version_dir):
+        print("Version is not installed!")
+        return []
+
+    with tracing.root("verify", config, version=version_name):
+        version = versions.Version(version_name, config)
+        runtime = None
+        if not config.game_config.custom_java_path:
+            runtime = version.java_version
+
+        bad = _verify(
+            _version_jobs(version, config),
+            runtime,
+            f"Repairing {version_name}",
+            config,
+            repair,
+        )
+
+        # Extracted natives have no hashes, missing ones are extracted again
+        if repair:
+            libraries.download_natives(version.natives, version_name, config)
+
+    return bad
+
+
+def verify_instance(
+    name: str, config: LauncherConfig = DEFAULT_CONFIG, repair: bool = False
+) -> list[str]:
+    """Check the version of an instance and the files of its modpack, with
+    `repair` the missing or corrupt files are downloaded again. Overrides
+    aren't checked, the game edits them. Returns the bad files."""
+    instance_dir = os.path.join(config.instances_dir, name)
+    if not os.path.exists(instance_dir):
+        print("Instance doesn't exist!")
+        return []
+
+    with open(os.path.join(instance_dir, "instance.json")) as f:
+        instance = json.load(f)
+
+    with tracing.root("verify", config, instance=name):
+        version = versions.Version(instance["minecraft"], config)
+        runtime = None
+        if not config.game_config.custom_java_path:
+            runtime = version.java_version
+
+        game_dir = os.path.join(config.game_dir, name)
+        jobs = _version_jobs(version, config) + [
+            (
+                f["downloads"],
+                mrpack._game_path(game_dir, f["path"]),
+                f["sha1"],
+                f["size"],
+                None,
+                True,
+            )
+            for f in instance.get("files", [])
+        ]
+
+        bad = _verify(jobs, runtime, f"Repairing {name}", config, repair)
+
+        if repair:
+            libraries.download_natives(version.natives, version.version_name, config)
+
+    return bad
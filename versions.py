@@ -1,8 +1,43 @@
 from config import LauncherConfig, DEFAULT_CONFIG
-from libraries import Library, Native, Rule
+from libraries import Library, Native, Rule, NATIVES_EXCLUDE
+import pickle
 import json
 import os
 
+# Bump when the cached fields or the parsing change
+VERSION_CACHE_FORMAT = 4
+
+# Resolved fields stored in the version cache
+CACHED_FIELDS = (
+    "version_id",
+    "asset_json_url",
+    "asset_index",
+    "client_url",
+    "client_sha1",
+    "client_size",
+    "server_url",
+    "server_sha1",
+    "server_size",
+    "java_version",
+    "main_class",
+    "jvm_args",
+    "game_args",
+    "libraries",
+    "natives",
+    "inherit_version",
+    "has_own_jvm_args",
+    "chain",
+)
+
+
+def stamp_files(paths: list[str]) -> list[tuple[str, int, int]]:
+    stamps = []
+    for path in paths:
+        st = os.stat(path)
+        stamps.append((path, st.st_mtime_ns, st.st_size))
+
+    return stamps
+
 
 def parse_rules(rules_json):
     rules = []
@@ -43,33 +78,41 @@ def get_lib_url(lib: dict):
 
     url: str = lib.get("url", "https://libraries.minecraft.net").removesuffix("/")
 
-    path, libname, version = str(lib["name"]).split(":")
+    path, libname, version, *classifier = str(lib["name"]).split(":")
+    filename = "-".join([libname, version, *classifier]) + ".jar"
 
-    return f"{url}/{path.replace('.', '/')}/{libname}/{version}/{libname}-{version}.jar"
+    return f"{url}/{path.replace('.', '/')}/{libname}/{version}/{filename}"
 
 
-def join_libs(libs1: list[Library] | list[Native], libs2: list[Library] | list[Native]):
-    # A.N. is genious
-    return libs1 + libs2
+def get_lib_hash(lib: dict) -> tuple[str | None, int | None]:
+    if "downloads" in lib and "artifact" in lib["downloads"]:
+        artifact = lib["downloads"]["artifact"]
+        return (artifact.get("sha1"), artifact.get("size"))
 
-    combined_libs = {}
+    return (lib.get("sha1"), lib.get("size"))
 
-    for lib in libs1:
-        combined_libs[(lib.name, lib.classifier, frozenset(lib.rules))] = lib
 
-    for lib in libs2:
-        combined_libs[(lib.name, lib.classifier, frozenset(lib.rules))] = lib
+def join_libs(libs1: list[Library], libs2: list[Library]) -> list[Library]:
+    """The libraries of a version after those of the version it inherits.
 
-    return list(combined_libs.values())
+    A library listed by both is kept once. Conflicting versions depend on
+    the rules, so they are resolved when the libraries are used.
+    """
+    return list(dict.fromkeys(libs1 + libs2))
 
 
 def get_lib_path(lib: dict):
     if "downloads" in lib:
         return lib["downloads"]["artifact"]["path"]
 
-    path, libname, version = str(lib["name"]).split(":")
+    path, libname, version, *classifier = str(lib["name"]).split(":")
+    filename = "-".join([libname, version, *classifier]) + ".jar"
+
+    return os.path.join(*path.split("."), libname, version, filename)
+
 
-    return os.path.join(*path.split("."), libname, version, f"{libname}-{version}.jar")
+def get_native_exclude(lib: dict) -> list[str]:
+    return NATIVES_EXCLUDE + lib.get("extract", {}).get("exclude", [])
 
 
 def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
@@ -85,6 +128,7 @@ def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
         if len(split_name) > 3:
             if "natives" in split_name[3]:
                 url = get_lib_url(lib)
+                sha1, size = get_lib_hash(lib)
                 rules = []
                 if "rules" in lib:
                     rules = parse_rules(lib["rules"])
@@ -92,7 +136,16 @@ def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
                 native_platform = split_name[3].replace("natives-", "")
 
                 natives.append(
-                    Native(split_name[1], split_name[-1], url, native_platform, rules)
+                    Native(
+                        split_name[1],
+                        split_name[2],
+                        url,
+                        native_platform,
+                        rules,
+                        sha1=sha1,
+                        size=size,
+                        exclude=get_native_exclude(lib),
+                    )
                 )
                 continue
 
@@ -110,7 +163,16 @@ def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
                     rules = parse_rules(lib["rules"])
 
                 natives.append(
-                    Native(split_name[1], split_name[-1], url, nat_name, rules)
+                    Native(
+                        split_name[1],
+                        split_name[2],
+                        url,
+                        nat_name,
+                        rules,
+                        sha1=native.get("sha1"),
+                        size=native.get("size"),
+                        exclude=get_native_exclude(lib),
+                    )
                 )
 
             continue
@@ -118,6 +180,7 @@ def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
         # Parse libraries
         url = get_lib_url(lib)
         lib_path = get_lib_path(lib)
+        sha1, size = get_lib_hash(lib)
 
         classifier = None
         if len(split_name) > 3:
@@ -131,11 +194,14 @@ def parse_libraries(raw_version: dict) -> tuple[list[Library], list[Native]]:
         libraries.append(
             Library(
                 split_name[1],
-                split_name[-1],
+                split_name[2],
                 url,
                 lib_path,
                 classifier=classifier,
                 rules=rules,
+                sha1=sha1,
+                size=size,
+                group=split_name[0],
             )
         )
 
@@ -234,13 +300,19 @@ class Version:
     asset_index: str
     asset_json_url: str
     client_url: str
+    client_sha1: str | None
+    client_size: int | None
     server_url: str | None
+    server_sha1: str | None
+    server_size: int | None
     java_version: str
     main_class: str
     libraries: list[Library]
     natives: list[Native]
     inherit_version: str | None = None
     has_own_jvm_args: bool = False
+    # Version json files of the inheritance chain, this version first
+    chain: list[str]
 
     def __init__(
         self,
@@ -253,6 +325,42 @@ class Version:
             config.versions_dir, config.platform, version_name
         )
         self.version_manifest = os.path.join(self.version_dir, f"{version_name}.json")
+        self.version_cache = os.path.join(self.version_dir, f"{version_name}.cache")
+
+        if not self._load_cache():
+            self._parse()
+            self._save_cache()
+
+    def _load_cache(self) -> bool:
+        """Load the resolved version, if no file of the chain has changed."""
+        try:
+            with open(self.version_cache, "rb") as f:
+                cache_format, stamps, values = pickle.load(f)
+
+            if cache_format != VERSION_CACHE_FORMAT:
+                return False
+            if stamp_files([path for path, _, _ in stamps]) != stamps:
+                return False
+        except Exception:
+            return False
+
+        for field, value in zip(CACHED_FIELDS, values):
+            setattr(self, field, value)
+
+        return True
+
+    def _save_cache(self):
+        values = tuple(getattr(self, field) for field in CACHED_FIELDS)
+        with open(self.version_cache + ".part", "wb") as f:
+            pickle.dump(
+                (VERSION_CACHE_FORMAT, stamp_files(self.chain), values),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(self.version_cache + ".part", self.version_cache)
+
+    def _parse(self):
+        self.chain = [self.version_manifest]
 
         raw_version = None
         with open(self.version_manifest, "r") as vm:
@@ -262,8 +370,14 @@ class Version:
 
         asset_json_url = raw_version.get("assetIndex", {}).get("url", None)
         asset_index = raw_version.get("assetIndex", {}).get("id", None)
-        client_url = raw_version.get("downloads", {}).get("client", {}).get("url", None)
-        server_url = raw_version.get("downloads", {}).get("server", {}).get("url", None)
+        client = raw_version.get("downloads", {}).get("client", {})
+        server = raw_version.get("downloads", {}).get("server", {})
+        client_url = client.get("url", None)
+        client_sha1 = client.get("sha1", None)
+        client_size = client.get("size", None)
+        server_url = server.get("url", None)
+        server_sha1 = server.get("sha1", None)
+        server_size = server.get("size", None)
 
         java_version = raw_version.get("javaVersion", {}).get("component", None)
 
@@ -278,14 +392,21 @@ class Version:
         if "inheritsFrom" in raw_version:
             self.inherit_version = raw_version["inheritsFrom"]
             assert self.inherit_version is not None
-            v = Version(self.inherit_version)
+            v = Version(self.inherit_version, self.config)
+            self.chain += v.chain
 
             asset_json_url = (
                 asset_json_url if asset_json_url is not None else v.asset_json_url
             )
             asset_index = asset_index if asset_index is not None else v.asset_index
-            client_url = client_url if client_url is not None else v.client_url
-            server_url = server_url if server_url is not None else v.server_url
+            if client_url is None:
+                client_url = v.client_url
+                client_sha1 = v.client_sha1
+                client_size = v.client_size
+            if server_url is None:
+                server_url = v.server_url
+                server_sha1 = v.server_sha1
+                server_size = v.server_size
             java_version = java_version if java_version is not None else v.java_version
             main_class = main_class if main_class is not None else v.main_class
 
@@ -318,7 +439,11 @@ class Version:
         self.asset_json_url = asset_json_url
         self.asset_index = asset_index
         self.client_url = client_url
+        self.client_sha1 = client_sha1
+        self.client_size = client_size
         self.server_url = server_url
+        self.server_sha1 = server_sha1
+        self.server_size = server_size
         self.java_version = java_version
         self.main_class = main_class
         self.jvm_args = jvm_args